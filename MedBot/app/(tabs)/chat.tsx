@@ -260,7 +260,8 @@ export default function Chat() {
 
       // If there's an audio response from the doctor, add it to the message
       if (data.voice_of_doctor) {
-        botMessage.audioUri = `${SERVER_URL}${data.voice_of_doctor}`;
+        // AAC plays natively on iOS and Android and is far smaller than the MP3 source
+        botMessage.audioUri = `${SERVER_URL}${data.voice_of_doctor}?format=aac`;
       }
 
       setMessages((prev) => [...prev, botMessage]);
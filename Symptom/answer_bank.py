@@ -0,0 +1,254 @@
+"""Precomputed answers for high-frequency symptom and prevention questions.
+
+An offline job generates an answer, YouTube links (preventive only) and pre-rendered
+audio for every condition in a list. Entries are stored by (kind, canonical disease)
+so refreshes can regenerate them in place, and indexed by the embeddings of a few
+canonical phrasings; the online graph serves an approved entry whenever a query's
+nearest neighbour clears the similarity threshold and the session has no earlier turns.
+
+    python answer_bank.py build   [--conditions FILE] [--version V] [--auto-approve]
+    python answer_bank.py refresh [--version V]   # rebuild every entry not at V
+    python answer_bank.py approve [disease ...]   # mark pending entries as vetted
+    python answer_bank.py list
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ------------------ Configuration ------------------
+ANSWER_BANK_DIR = os.getenv("ANSWER_BANK_DIR", "./answer_bank_data")
+ANSWER_BANK_AUDIO_DIR = os.path.join(ANSWER_BANK_DIR, "audio")
+ANSWER_BANK_CONDITIONS = os.getenv("ANSWER_BANK_CONDITIONS", "answer_bank_conditions.txt")
+ANSWER_BANK_THRESHOLD = float(os.getenv("ANSWER_BANK_THRESHOLD", "0.88"))
+ANSWER_BANK_REQUIRE_APPROVAL = os.getenv("ANSWER_BANK_REQUIRE_APPROVAL", "1") == "1"
+
+KIND_BY_NODE = {"symptom_agent": "symptom", "preventive_measure_agent": "preventive"}
+
+PHRASINGS = {
+    "symptom": [
+        "What are the symptoms of {disease}?",
+        "{disease} symptoms",
+        "Do I have {disease}?",
+        "What are the signs of {disease} and when should I see a doctor?"
+    ],
+    "preventive": [
+        "How can I prevent {disease}?",
+        "{disease} prevention tips",
+        "How do I avoid getting {disease}?",
+        "Tips to reduce the risk of {disease}"
+    ]
+}
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+
+# ------------------ Storage ------------------
+def _path(name):
+    return os.path.join(ANSWER_BANK_DIR, name)
+
+
+def _write_json(name, payload):
+    os.makedirs(ANSWER_BANK_DIR, exist_ok=True)
+    tmp = _path(name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, _path(name))
+
+
+def load_bank():
+    """Return (manifest, entries); entries are keyed by "<kind>:<disease slug>" """
+    if not os.path.exists(_path("entries.json")):
+        return {"version": None}, {}
+    with open(_path("manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(_path("entries.json"), encoding="utf-8") as f:
+        entries = json.load(f)
+    return manifest, entries
+
+
+def save_bank(manifest, entries, embeddings):
+    """Persist entries and rebuild the phrasing-embedding index in one go"""
+    keys, rows = [], []
+    for key, entry in sorted(entries.items()):
+        phrasings = [p.format(disease=entry["disease"]) for p in PHRASINGS[entry["kind"]]]
+        for vector in embeddings.embed_documents(phrasings):
+            keys.append(key)
+            rows.append(vector)
+    matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+    if len(rows):
+        matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    os.makedirs(ANSWER_BANK_DIR, exist_ok=True)
+    np.save(_path("embeddings.tmp.npy"), matrix)
+    os.replace(_path("embeddings.tmp.npy"), _path("embeddings.npy"))
+    _write_json("index_keys.json", keys)
+    _write_json("entries.json", entries)
+    manifest["updated_at"] = time.time()
+    _write_json("manifest.json", manifest)
+
+
+# ------------------ Offline generation ------------------
+def generate_entry(kind, disease, version, approved):
+    from voice_of_the_doctor import text_to_speech_with_elevenlabs
+
+    youtube_links = ""
+    if kind == "symptom":
+        from symptom_agent.rag_agent import retrieve, answer_with_context
+        question = PHRASINGS["symptom"][3].format(disease=disease)
+        docs, query_vector, doc_vectors = retrieve(question)
+        answer, _ = answer_with_context(
+            question, docs, query_vector=query_vector, lexical_only=query_vector is None, doc_vectors=doc_vectors
+        )
+    else:
+        from preventive_agent.preventive_rag_agent import create_preventive_rag_agent
+        from preventive_agent.preventive_youtube_agent import create_preventive_youtube_agent
+        from preventive_agent.preventive_measure_agent import compose_preventive_response
+        state = {"query_text": f"How can I prevent {disease}? Preventive tips."}
+        rag_text = create_preventive_rag_agent()(state)["rag_response"]
+        youtube_links = create_preventive_youtube_agent()(state)["youtube_response"]
+        answer = compose_preventive_response(rag_text, youtube_links)
+
+    os.makedirs(ANSWER_BANK_AUDIO_DIR, exist_ok=True)
+    audio_path = os.path.join(ANSWER_BANK_AUDIO_DIR, f"bank_{kind}_{_slug(disease)}_{_slug(version)}.mp3")
+    try:
+        text_to_speech_with_elevenlabs(input_text=answer, output_filepath=audio_path, play=False)
+    except Exception as e:
+        print(f"[answer bank] Audio failed for {kind}/{disease}: {e}")
+        audio_path = ""
+
+    return {
+        "kind": kind,
+        "disease": disease,
+        "answer": answer,
+        "youtube_links": youtube_links,
+        "audio_path": audio_path,
+        "version": version,
+        "status": "approved" if approved else "pending",
+        "generated_at": time.time()
+    }
+
+
+def load_conditions(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def build(conditions, version, auto_approve=False, only_stale=False):
+    """Generate entries for every condition; with only_stale, keep entries already at version"""
+    from symptom_agent.rag_agent import get_embeddings
+
+    manifest, entries = load_bank()
+    manifest["version"] = version
+    for disease in conditions:
+        for kind in PHRASINGS:
+            key = f"{kind}:{_slug(disease)}"
+            if only_stale and entries.get(key, {}).get("version") == version:
+                continue
+            print(f"[answer bank] Generating {key} ({version})")
+            try:
+                entries[key] = generate_entry(kind, disease, version, auto_approve)
+            except Exception as e:
+                print(f"[answer bank] Failed {key}: {e}")
+    save_bank(manifest, entries, get_embeddings())
+    return entries
+
+
+# ------------------ Online lookup ------------------
+class AnswerBank:
+    """Read-only view of the bank used by the online graph; reloads when the files change"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.entries, self.keys, self.matrix, self.version = {}, [], None, None
+
+    def _maybe_reload(self):
+        manifest_path = _path("manifest.json")
+        if not os.path.exists(manifest_path):
+            return
+        mtime = os.path.getmtime(manifest_path)
+        if mtime == self._loaded_at:
+            return
+        with self._lock:
+            manifest, self.entries = load_bank()
+            self.version = manifest.get("version")
+            with open(_path("index_keys.json"), encoding="utf-8") as f:
+                self.keys = json.load(f)
+            self.matrix = np.load(_path("embeddings.npy"))
+            self._loaded_at = mtime
+
+    def _servable(self, entry):
+        if entry["version"] != self.version:
+            return False
+        return entry["status"] == "approved" or not ANSWER_BANK_REQUIRE_APPROVAL
+
+    def lookup(self, kind, query):
+        """Nearest-neighbour lookup; returns (entry, similarity) or (None, best similarity)"""
+        self._maybe_reload()
+        if self.matrix is None or not len(self.keys) or not query:
+            return None, 0.0
+        from symptom_agent.rag_agent import get_embeddings
+        vector = np.asarray(get_embeddings().embed_query(query), dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        scores = self.matrix @ vector
+
+        for i in np.argsort(-scores):
+            if scores[i] < ANSWER_BANK_THRESHOLD:
+                break
+            entry = self.entries.get(self.keys[i])
+            if entry and entry["kind"] == kind and self._servable(entry):
+                return entry, float(scores[i])
+        return None, float(scores.max())
+
+
+answer_bank = AnswerBank()
+
+
+# ------------------ CLI ------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the precomputed answer bank")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("build", "refresh"):
+        command = sub.add_parser(name)
+        command.add_argument("--conditions", default=ANSWER_BANK_CONDITIONS)
+        command.add_argument("--version", default=time.strftime("%Y%m%d"))
+        command.add_argument("--auto-approve", action="store_true")
+    approve = sub.add_parser("approve")
+    approve.add_argument("diseases", nargs="*", help="approve only these diseases (default: all pending)")
+    sub.add_parser("list")
+    args = parser.parse_args(argv)
+
+    if args.command in ("build", "refresh"):
+        build(load_conditions(args.conditions), args.version, args.auto_approve, only_stale=args.command == "refresh")
+    elif args.command == "approve":
+        manifest, entries = load_bank()
+        wanted = {_slug(d) for d in args.diseases}
+        approved = 0
+        for entry in entries.values():
+            if entry["status"] == "pending" and (not wanted or _slug(entry["disease"]) in wanted):
+                entry["status"] = "approved"
+                approved += 1
+        _write_json("entries.json", entries)
+        manifest["updated_at"] = time.time()
+        _write_json("manifest.json", manifest)
+        print(f"Approved {approved} entries")
+    else:
+        manifest, entries = load_bank()
+        print(f"Bank version {manifest.get('version')}, {len(entries)} entries")
+        for key, entry in sorted(entries.items()):
+            stale = "" if entry["version"] == manifest.get("version") else " (stale)"
+            print(f"  {key:<40} {entry['status']:<9} {entry['version']}{stale}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
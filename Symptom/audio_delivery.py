@@ -0,0 +1,118 @@
+import os
+import gzip
+import hashlib
+import subprocess
+from request_coalescing import SingleFlight
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is used when brotli isn't installed
+    brotli = None
+
+# ------------------ Audio formats ------------------
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# Speech-tuned low bitrates; the ElevenLabs source is already 32 kbps mono MP3
+AUDIO_FORMATS = {
+    "opus": {
+        "extension": "ogg",
+        "mimetype": "audio/ogg",
+        "args": ["-c:a", "libopus", "-b:a", "16k", "-application", "voip"]
+    },
+    "aac": {
+        "extension": "m4a",
+        "mimetype": "audio/mp4",
+        # faststart puts the index first so playback can begin before the download ends
+        "args": ["-c:a", "aac", "-b:a", "24k", "-ac", "1", "-movflags", "+faststart"]
+    },
+    "mp3": {
+        "extension": "mp3",
+        "mimetype": "audio/mpeg",
+        "args": None
+    }
+}
+
+_transcode_flight = SingleFlight("transcode")
+
+
+def negotiate_audio_format(requested, accept_header):
+    """Pick opus, aac or mp3 from an explicit ?format= or the client's Accept header"""
+    if requested in AUDIO_FORMATS:
+        return requested
+    accept = (accept_header or "").lower()
+    if "opus" in accept or "audio/ogg" in accept or "audio/webm" in accept:
+        return "opus"
+    if "audio/aac" in accept or "audio/mp4" in accept or "audio/m4a" in accept:
+        return "aac"
+    return "mp3"
+
+
+def _transcode(source_path, target_path, audio_format):
+    tmp_path = f"{target_path}.{os.getpid()}.tmp.{AUDIO_FORMATS[audio_format]['extension']}"
+    subprocess.run(
+        [FFMPEG, "-y", "-loglevel", "error", "-i", source_path, *AUDIO_FORMATS[audio_format]["args"], tmp_path],
+        check=True, timeout=60
+    )
+    os.replace(tmp_path, target_path)
+    return target_path
+
+
+def transcoded_audio(source_path, audio_format):
+    """Return (path, mimetype) for source_path in audio_format, transcoding once and caching.
+
+    The cache key includes the source's size and mtime, so a regenerated file such
+    as final.mp3 gets a fresh transcode. Falls back to the original MP3 when ffmpeg
+    is unavailable or fails.
+    """
+    spec = AUDIO_FORMATS[audio_format]
+    if spec["args"] is None:
+        return source_path, spec["mimetype"]
+
+    stat = os.stat(source_path)
+    key = hashlib.sha1(f"{os.path.abspath(source_path)}:{stat.st_size}:{stat.st_mtime_ns}:{audio_format}".encode()).hexdigest()
+    target_path = os.path.join(AUDIO_CACHE_DIR, f"{key}.{spec['extension']}")
+    if os.path.exists(target_path):
+        return target_path, spec["mimetype"]
+
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    try:
+        _transcode_flight.do(key, _transcode, source_path, target_path, audio_format)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Transcoding to {audio_format} failed, serving MP3: {e}")
+        return source_path, AUDIO_FORMATS["mp3"]["mimetype"]
+    return target_path, spec["mimetype"]
+
+
+# ------------------ Response compression ------------------
+COMPRESS_MIN_BYTES = 512
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html"}
+
+
+def compress_response(response, accept_encoding):
+    """Brotli- or gzip-encode small textual responses (JSON consultations) for mobile clients"""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    accept_encoding = (accept_encoding or "").lower()
+    if brotli is not None and "br" in accept_encoding:
+        body, encoding = brotli.compress(data, quality=5), "br"
+    elif "gzip" in accept_encoding:
+        body, encoding = gzip.compress(data, compresslevel=6), "gzip"
+    else:
+        return response
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = str(len(body))
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,57 @@
+"""Lookup time of the perceptual-hash BK-tree versus index size.
+
+Fills the tree with random 64-bit hashes plus near-duplicates of a few query
+hashes, then times BK-tree range lookups against a linear Hamming scan.
+
+Run from the Symptom directory:
+    python benchmarks/image_cache_benchmark.py [max_distance]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from symptom_agent.image_hash_cache import BKTree, hamming
+
+SIZES = [1_000, 10_000, 50_000, 100_000]
+QUERIES = 200
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def main():
+    max_distance = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    rng = random.Random(42)
+    print(f"max hamming distance {max_distance}, {QUERIES} queries per size")
+    for size in SIZES:
+        hashes = [rng.getrandbits(64) for _ in range(size)]
+        tree = BKTree()
+        start = time.perf_counter()
+        for value in hashes:
+            tree.add(value)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # Half the queries are near-duplicates of stored hashes, half are unseen images
+        queries = [flip_bits(rng.choice(hashes), rng.randint(0, max_distance), rng) for _ in range(QUERIES // 2)]
+        queries += [rng.getrandbits(64) for _ in range(QUERIES - len(queries))]
+
+        start = time.perf_counter()
+        tree_hits = sum(bool(tree.search(q, max_distance)) for q in queries)
+        tree_us = (time.perf_counter() - start) * 1e6 / QUERIES
+
+        start = time.perf_counter()
+        scan_hits = sum(any(hamming(q, h) <= max_distance for h in hashes) for q in queries)
+        scan_us = (time.perf_counter() - start) * 1e6 / QUERIES
+
+        print(f"{size:>7} hashes  build={build_ms:7.1f}ms  bk-tree={tree_us:8.1f}us/lookup  "
+              f"linear={scan_us:9.1f}us/lookup  hits={tree_hits}/{scan_hits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Retrieval quality and latency benchmark for the symptom RAG corpus.
+
+Compares dense-only, BM25-only and hybrid (RRF) retrieval on a labeled set.
+Each line of the labels file is {"query": ..., "relevant": [phrases]}; a result
+counts as relevant when its text contains any of the phrases.
+
+Run from the Symptom directory:
+    python benchmarks/retrieval_benchmark.py [labels.jsonl] [k]
+"""
+import os
+import sys
+import json
+import time
+import statistics
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from symptom_agent.rag_agent import get_vectorstore, get_bm25_index, retrieve
+from symptom_agent.bm25_index import reciprocal_rank_fusion
+
+
+def load_labels(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def is_relevant(doc, phrases):
+    text = doc.page_content.lower()
+    return any(phrase.lower() in text for phrase in phrases)
+
+
+def run_mode(name, search, labels, k):
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for label in labels:
+        start = time.perf_counter()
+        docs = search(label["query"])[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        ranks = [rank for rank, doc in enumerate(docs, 1) if is_relevant(doc, label["relevant"])]
+        hits += bool(ranks)
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+    latencies.sort()
+    print(f"{name:<8} recall@{k}={hits / len(labels):.2f} MRR={statistics.mean(reciprocal_ranks):.2f} "
+          f"p50={statistics.median(latencies):.1f}ms p95={latencies[int(0.95 * (len(latencies) - 1))]:.1f}ms")
+
+
+def main():
+    labels_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "retrieval_labels.jsonl")
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    labels = load_labels(labels_path)
+
+    vectorstore = get_vectorstore()
+    index = get_bm25_index()
+
+    def dense(query):
+        return vectorstore.similarity_search(query, k=k)
+
+    def sparse(query):
+        return index.search_documents(query, k)
+
+    def hybrid(query):
+        return reciprocal_rank_fusion([dense(query), sparse(query)], k)
+
+    def production(query):
+        return retrieve(query, k)[0]
+
+    # Warm up the embedding model so the first dense query isn't penalized
+    dense("warm up")
+
+    print(f"{len(labels)} labeled queries, {len(index.texts)} chunks")
+    run_mode("dense", dense, labels, k)
+    run_mode("bm25", sparse, labels, k)
+    run_mode("hybrid", hybrid, labels, k)
+    run_mode("routed", production, labels, k)
+    fast = sum(index.is_keyword_query(label["query"]) for label in labels)
+    print(f"{fast}/{len(labels)} queries took the lexical fast path in 'routed'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""RSS, load time and recall@k of the vector store backends.
+
+Compares the persisted Chroma store, an in-memory FAISS index (as the preventive
+agent builds it) and the int8 memory-mapped store, all over the chunks and
+embeddings already in ./chroma_db. Each backend runs in its own subprocess so
+its resident memory is measured in isolation; recall@k is measured against
+exact float32 cosine search.
+
+Run from the Symptom directory:
+    python benchmarks/vector_store_benchmark.py [k]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+LABELS_PATH = os.path.join(os.path.dirname(__file__), "retrieval_labels.jsonl")
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_backend(backend, workdir, k):
+    """Child process: load one backend, query it and print a JSON report"""
+    query_vectors = np.load(os.path.join(workdir, "queries.npy"))
+    baseline = rss_mb()
+    start = time.perf_counter()
+
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        store = Chroma(persist_directory="./chroma_db")
+        store.get(limit=1)  # force the collection to open
+    elif backend == "faiss":
+        from langchain.vectorstores import FAISS
+        with open(os.path.join(workdir, "texts.json"), encoding="utf-8") as f:
+            texts = json.load(f)
+        vectors = np.load(os.path.join(workdir, "vectors.npy"))
+        store = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), embedding=None)
+    else:
+        from quantized_store import QuantizedMmapVectorStore
+        store = QuantizedMmapVectorStore(os.path.join(workdir, "mmap"), embedding=None)
+
+    load_ms = (time.perf_counter() - start) * 1000
+    results, latencies = [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        docs = store.similarity_search_by_vector(vector.tolist(), k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([doc.page_content for doc in docs])
+
+    print(json.dumps({
+        "load_ms": load_ms,
+        "rss_mb": rss_mb() - baseline,
+        "query_ms": float(np.median(latencies)),
+        "results": results
+    }))
+
+
+def main():
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    from langchain_community.vectorstores import Chroma
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from quantized_store import QuantizedMmapVectorStore
+    from symptom_agent.rag_agent import EMBEDDING_MODEL
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    stored = Chroma(persist_directory="./chroma_db", embedding_function=embeddings).get(
+        include=["documents", "embeddings"]
+    )
+    texts, vectors = stored["documents"], np.asarray(stored["embeddings"], dtype=np.float32)
+    with open(LABELS_PATH, encoding="utf-8") as f:
+        queries = [json.loads(line)["query"] for line in f if line.strip()]
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+
+    # Exact float32 ground truth
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit_queries = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    truth = [{texts[i] for i in np.argsort(-(unit @ q))[:k]} for q in unit_queries]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        np.save(os.path.join(workdir, "queries.npy"), query_vectors)
+        np.save(os.path.join(workdir, "vectors.npy"), vectors)
+        with open(os.path.join(workdir, "texts.json"), "w", encoding="utf-8") as f:
+            json.dump(texts, f)
+        QuantizedMmapVectorStore(os.path.join(workdir, "mmap"), embeddings).add_embeddings(texts, vectors)
+        disk_mb = sum(
+            os.path.getsize(os.path.join(workdir, "mmap", name))
+            for name in os.listdir(os.path.join(workdir, "mmap"))
+        ) / (1024 * 1024)
+
+        print(f"{len(texts)} chunks, {len(queries)} queries, dim {vectors.shape[1]}, mmap index {disk_mb:.1f} MB on disk")
+        for backend in ("chroma", "faiss", "mmap"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", backend, workdir, str(k)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            report = json.loads(output)
+            recall = np.mean([
+                len(truth_set & set(result)) / len(truth_set)
+                for truth_set, result in zip(truth, report["results"])
+            ])
+            print(f"{backend:<7} load={report['load_ms']:.0f}ms rss=+{report['rss_mb']:.1f}MB "
+                  f"query p50={report['query_ms']:.2f}ms recall@{k}={recall:.3f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_backend(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
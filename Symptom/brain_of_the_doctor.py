@@ -2,8 +2,8 @@ import base64
 from groq import Groq
 
 def encode_image(image_path):   
-    image_file = open(image_path, "rb")
-    return base64.b64encode(image_file.read()).decode('utf-8')
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
 
 def analyze_image_with_query(query, model, encoded_image):
     client = Groq()  
@@ -0,0 +1,158 @@
+import os
+import re
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from symptom_agent.bm25_index import tokenize
+
+# ------------------ Configuration ------------------
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "12"))          # over-retrieve this many chunks
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))  # 1.0 = pure relevance
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "6"))
+NEAR_DUPLICATE_SIMILARITY = 0.95
+MAX_SENTENCES_PER_CHUNK = 4
+MAX_CANDIDATE_CHUNKS = 200  # cap on candidate chunks from long documents
+
+_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+_sentence_pattern = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) used for budgeting"""
+    return len(text or "") // 4 + 1
+
+
+def _terms(text):
+    return set(tokenize(text))
+
+
+def _split_long(texts, vectors):
+    """Return [(chunk, stored vector or None)]; pieces split from long texts have no vector"""
+    chunks = []
+    for text, vector in zip(texts, vectors):
+        if len(text) > 1000:
+            chunks.extend((piece, None) for piece in _splitter.split_text(text))
+        elif text.strip():
+            chunks.append((text, vector))
+    return chunks[:MAX_CANDIDATE_CHUNKS]
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+def _mmr(query_vector, chunk_vectors, k, lambda_mult):
+    """Maximal marginal relevance selection that also skips near-duplicate chunks"""
+    relevance = chunk_vectors @ query_vector
+    selected = []
+    candidates = list(np.argsort(-relevance))
+    while candidates and len(selected) < k:
+        best, best_score = None, -np.inf
+        for i in candidates:
+            redundancy = max((float(chunk_vectors[i] @ chunk_vectors[j]) for j in selected), default=0.0)
+            if redundancy >= NEAR_DUPLICATE_SIMILARITY:
+                continue
+            score = lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        selected.append(best)
+        candidates.remove(best)
+    return selected
+
+
+def _lexical_order(chunks):
+    """Keep retrieval order without embeddings, skipping chunks whose terms mostly repeat a kept one"""
+    selected, kept_terms = [], []
+    for i, chunk in enumerate(chunks):
+        terms = _terms(chunk)
+        duplicate = any(
+            len(terms & other) / max(len(terms | other), 1) >= NEAR_DUPLICATE_SIMILARITY
+            for other in kept_terms
+        )
+        if not duplicate:
+            selected.append(i)
+            kept_terms.append(terms)
+        if len(selected) == CONTEXT_MAX_CHUNKS:
+            break
+    return selected
+
+
+def _extract_sentences(chunk, query_terms):
+    """Keep the sentences that share the most terms with the query, in original order"""
+    sentences = [s.strip() for s in _sentence_pattern.split(chunk) if s.strip()]
+    if len(sentences) <= MAX_SENTENCES_PER_CHUNK:
+        return " ".join(sentences)
+    scored = sorted(
+        range(len(sentences)),
+        key=lambda i: len(query_terms & _terms(sentences[i])),
+        reverse=True
+    )
+    keep = sorted(scored[:MAX_SENTENCES_PER_CHUNK])
+    return " ".join(sentences[i] for i in keep)
+
+
+def assemble_context(query, docs, embeddings, token_budget=None, query_vector=None, doc_vectors=None):
+    """Turn over-retrieved documents into a compact, diverse context for the prompt.
+
+    Long documents are split, chunks are picked with MMR (dropping near-duplicates;
+    pass embeddings=None to keep retrieval order and compare terms instead),
+    each chunk is reduced to its most query-relevant sentences and the result is
+    packed into token_budget. doc_vectors, aligned with docs, carries the vectors
+    the store already holds; only chunks without one are embedded here. Returns
+    (context_text, stats) where stats reports the tokens the raw concatenation
+    would have cost and the tokens saved.
+    """
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    texts = [doc.page_content for doc in docs]
+    raw_tokens = estimate_tokens("\n\n".join(texts))
+    chunks = _split_long(texts, doc_vectors if doc_vectors is not None else [None] * len(texts))
+    vectors = [vector for _, vector in chunks]
+    chunks = [chunk for chunk, _ in chunks]
+    if not chunks:
+        return "", {
+            "raw_tokens": raw_tokens, "context_tokens": 0, "tokens_saved": raw_tokens,
+            "chunks": 0, "embedded_chunks": 0, "excerpts": 0
+        }
+
+    query_terms = _terms(query)
+    missing = []
+    if embeddings is None:
+        order = _lexical_order(chunks)
+    else:
+        if query_vector is None:
+            query_vector = embeddings.embed_query(query)
+        query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, embeddings.embed_documents([chunks[i] for i in missing])):
+                vectors[i] = vector
+        chunk_vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        order = _mmr(query_vector, chunk_vectors, CONTEXT_MAX_CHUNKS, CONTEXT_MMR_LAMBDA)
+
+    packed, used = [], 0
+    for i in order:
+        excerpt = _extract_sentences(chunks[i], query_terms)
+        cost = estimate_tokens(excerpt)
+        if used + cost > token_budget:
+            remaining_chars = (token_budget - used) * 4
+            if remaining_chars < 200:
+                break
+            excerpt = excerpt[:remaining_chars]
+            cost = estimate_tokens(excerpt)
+        packed.append(excerpt)
+        used += cost
+
+    context = "\n\n".join(packed)
+    context_tokens = estimate_tokens(context)
+    stats = {
+        "raw_tokens": raw_tokens,
+        "context_tokens": context_tokens,
+        "tokens_saved": max(raw_tokens - context_tokens, 0),
+        "chunks": len(chunks),
+        "embedded_chunks": len(missing),
+        "excerpts": len(packed)
+    }
+    return context, stats
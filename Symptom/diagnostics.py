@@ -0,0 +1,287 @@
+"""On-demand diagnostics for a live worker: sampling CPU profiles, tracemalloc
+snapshots and diffs, open file descriptors and per-cache sizes.
+
+Nothing here runs until an admin asks: the profiler is a thread that exists only
+for the requested duration, tracemalloc is off unless started, and the cache
+report only inspects modules the worker has already imported.
+"""
+import os
+import sys
+import hmac
+import time
+import threading
+import tracemalloc
+from functools import lru_cache
+from collections import Counter
+
+# ------------------ Configuration ------------------
+# The admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+PROFILE_MIN_INTERVAL_MS = 1.0
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+
+# Leaf frames of threads that are parked rather than doing work, as (file relative
+# to the standard library, function). Matching the file keeps application
+# functions that happen to be called get or wait in the profile
+STDLIB_DIR = os.path.dirname(threading.__file__)
+IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"), ("selectors.py", "select"), ("socket.py", "accept"),
+    ("socket.py", "readinto"), ("ssl.py", "recv_into"), ("ssl.py", "read"),
+    ("socketserver.py", "serve_forever"), ("concurrent/futures/thread.py", "_worker"),
+    ("multiprocessing/connection.py", "_recv")
+}
+
+_profile_lock = threading.Lock()
+_tracemalloc_lock = threading.Lock()
+_last_snapshot = None
+
+
+def admin_authorized(token):
+    """Constant-time check of an admin token; always False when ADMIN_TOKEN is unset"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(str(token or ""), ADMIN_TOKEN)
+
+
+# ------------------ Sampling CPU profiler ------------------
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+@lru_cache(maxsize=4096)
+def _stdlib_path(filename):
+    if not filename.startswith(STDLIB_DIR + os.sep):
+        return None
+    return os.path.relpath(filename, STDLIB_DIR).replace(os.sep, "/")
+
+
+def _idle(frame):
+    code = frame.f_code
+    return (_stdlib_path(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def _collapse(frame):
+    """Render a frame chain root-first as a collapsed stack: fn (file:line);fn (file:line)"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def sample_profile(seconds=5.0, interval_ms=10.0, active_only=True):
+    """Sample every thread's stack for seconds and return collapsed-stack counts.
+
+    The output (one "stack count" line per distinct stack via format_collapsed)
+    loads directly into flamegraph.pl or speedscope. With active_only, samples
+    whose leaf is a blocking wait are dropped so idle pool threads don't dominate.
+    """
+    seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+    interval = max(float(interval_ms), PROFILE_MIN_INTERVAL_MS) / 1000.0
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if active_only and _idle(frame):
+                    continue
+                stacks[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+            samples += 1
+            time.sleep(interval)
+        return {"seconds": seconds, "interval_ms": interval * 1000, "samples": samples, "stacks": stacks}
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(stacks):
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+# ------------------ tracemalloc ------------------
+def _statistics(stats, limit):
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "size_diff_kb": round(getattr(stat, "size_diff", 0) / 1024, 1),
+            "count": stat.count,
+            "count_diff": getattr(stat, "count_diff", 0)
+        }
+        for stat in stats[:limit]
+    ]
+
+
+def tracemalloc_start():
+    """Start tracing allocations; costs memory and CPU until tracemalloc_stop"""
+    global _last_snapshot
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _last_snapshot = None
+        return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+
+def tracemalloc_snapshot(limit=25):
+    """Top allocation sites now, plus the growth since the previous snapshot"""
+    global _last_snapshot
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False, "error": "tracemalloc is not running; start it first"}
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "tracing": True,
+            "traced_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "top": _statistics(snapshot.statistics("lineno"), limit)
+        }
+        if _last_snapshot is not None:
+            report["diff"] = _statistics(snapshot.compare_to(_last_snapshot, "lineno"), limit)
+        _last_snapshot = snapshot
+        return report
+
+
+def tracemalloc_stop():
+    global _last_snapshot
+    with _tracemalloc_lock:
+        tracemalloc.stop()
+        _last_snapshot = None
+        return {"tracing": False}
+
+
+# ------------------ Process and cache report ------------------
+def open_file_descriptors(limit=200):
+    """Count and list this process's open descriptors (Linux /proc; None elsewhere)"""
+    fd_dir = "/proc/self/fd"
+    if not os.path.isdir(fd_dir):
+        return None
+    targets = []
+    for fd in os.listdir(fd_dir):
+        try:
+            targets.append(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            continue  # closed while listing, including the listdir handle itself
+    kinds = Counter(target.split(":", 1)[0] if ":[" in target else "file" for target in targets)
+    files = Counter(target for target in targets if not target.startswith(("socket:", "pipe:", "anon_inode:")))
+    return {
+        "count": len(targets),
+        "by_kind": dict(kinds),
+        "files": dict(files.most_common(limit))
+    }
+
+
+def _rss_kb():
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _loaded(name):
+    # Only inspect modules the worker already imported; importing one here
+    # could load models or open databases just to report on them
+    return sys.modules.get(name)
+
+
+def _text_bytes(texts):
+    return sum(len(text.encode("utf-8")) for text in texts if isinstance(text, str))
+
+
+def cache_sizes():
+    """Entry counts and approximate bytes for each in-process and shared cache"""
+    sizes = {}
+
+    def report(name, compute):
+        try:
+            sizes[name] = compute()
+        except Exception as e:
+            sizes[name] = {"error": str(e)}
+
+    if _loaded("shared_cache"):
+        report("shared_cache", sys.modules["shared_cache"].cache_stats)
+
+    if _loaded("symptom_agent.image_hash_cache"):
+        image_cache = sys.modules["symptom_agent.image_hash_cache"].image_cache
+        report("image_diagnoses", lambda: {
+            "entries": len(image_cache),
+            "bk_tree_nodes": image_cache._tree.size,
+            "approx_bytes": _text_bytes(entry["diagnosis"] for entry in list(image_cache._entries.values())),
+            "hits": image_cache.hits,
+            "misses": image_cache.misses
+        })
+
+    preventive = _loaded("preventive_agent.preventive_rag_agent")
+    if preventive:
+        def preventive_store():
+            store = preventive.vector_store
+            if isinstance(store, sys.modules["quantized_store"].QuantizedMmapVectorStore):
+                return {"backend": "mmap", "vectors": len(store), "dim": store.dim}
+            documents = list(store.docstore._dict.values())
+            return {
+                "backend": "faiss",
+                "vectors": store.index.ntotal,
+                "index_bytes": store.index.ntotal * store.index.d * 4,
+                "docstore_bytes": _text_bytes(doc.page_content for doc in documents)
+            }
+        report("preventive_vector_store", preventive_store)
+
+    rag = _loaded("symptom_agent.rag_agent")
+    if rag and rag._bm25_index is not None:
+        report("bm25_index", lambda: {
+            "documents": len(rag._bm25_index.texts),
+            "terms": len(rag._bm25_index.postings),
+            "approx_text_bytes": _text_bytes(rag._bm25_index.texts)
+        })
+
+    bank = _loaded("answer_bank")
+    if bank:
+        report("answer_bank", lambda: {
+            "entries": len(bank.answer_bank.entries),
+            "matrix_bytes": int(bank.answer_bank.matrix.nbytes) if bank.answer_bank.matrix is not None else 0
+        })
+
+    coalescing = _loaded("request_coalescing")
+    if coalescing:
+        flights = {}
+        for module in [m for m in list(sys.modules.values()) if m is not None]:
+            for value in list(vars(module).values()):
+                if isinstance(value, coalescing.SingleFlight):
+                    flights[value.name] = {"keys": len(value), "in_flight": value.in_flight()}
+        sizes["single_flight"] = flights
+
+    if _loaded("speculation"):
+        report("speculation", lambda: {"pending": sys.modules["speculation"].speculation_stats()["pending"]})
+
+    return sizes
+
+
+def diagnostics_report():
+    """Snapshot of this worker: RSS, threads, descriptors, GC and cache sizes"""
+    import gc
+
+    return {
+        "pid": os.getpid(),
+        "rss_kb": _rss_kb(),
+        "threads": sorted(thread.name for thread in threading.enumerate()),
+        "open_fds": open_file_descriptors(),
+        "gc": {"counts": gc.get_count(), "objects": len(gc.get_objects())},
+        "tracemalloc": tracemalloc.is_tracing(),
+        "profiling": _profile_lock.locked(),
+        "caches": cache_sizes()
+    }
@@ -1,8 +1,24 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-from main_agent import create_main_agent
+from main_agent import create_main_agent, invoke_batch
+from session_memory import get_checkpointer
+from answer_bank import ANSWER_BANK_AUDIO_DIR
+from voice_of_the_doctor import TTS_CACHE_DIR
+from request_coalescing import fingerprint, file_digest, graph_flight, idempotency_flight
+from shared_cache import cache_get, cache_set
+from audio_delivery import negotiate_audio_format, transcoded_audio, compress_response
+from speculation import speculation_stats
+from diagnostics import (
+    ADMIN_TOKEN, ProfilerBusy, admin_authorized, sample_profile, format_collapsed, diagnostics_report,
+    tracemalloc_start, tracemalloc_snapshot, tracemalloc_stop
+)
+from scheduler import (
+    URGENT, PRIORITY_NAMES, Overloaded, detect_urgency, shed_response, get_scheduler, get_rate_limiter
+)
 import os
+import traceback
+from functools import wraps
 from werkzeug.utils import secure_filename
 
 load_dotenv()
@@ -13,103 +29,297 @@ CORS(app)
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "64"))
+
+# Compiled graphs are reused across requests; the session graph is built lazily in
+# each worker so its SQLite checkpointer connection is never inherited across fork
+_agents = {}
+
+def get_agent(with_sessions=False):
+    """Return the compiled main agent, with or without the session checkpointer"""
+    if with_sessions not in _agents:
+        checkpointer = get_checkpointer() if with_sessions else None
+        _agents[with_sessions] = create_main_agent(checkpointer=checkpointer)
+    return _agents[with_sessions]
+
+def save_upload(file_storage):
+    """Save an uploaded file into UPLOAD_FOLDER and return its path"""
+    filename = secure_filename(file_storage.filename)
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    file_storage.save(filepath)
+    return filepath
+
+def voice_url(voice_of_doctor_path):
+    """Map a generated audio file to its download URL, or "" if none was produced"""
+    if voice_of_doctor_path and os.path.exists(voice_of_doctor_path):
+        return f"/download/{os.path.basename(voice_of_doctor_path)}"
+    return ""
+
 @app.route('/')
 def home():
     return "AI Doctor Backend is running."
+# Folders /download serves from, in lookup order: generated TTS output next to this
+# file, pre-rendered answer bank audio, then the size-capped TTS cache that batch
+# audio is served from. Only audio files are served, never uploads (other
+# patients' photos and recordings) or the app's databases
+DOWNLOAD_FOLDERS = [os.path.dirname(os.path.abspath(__file__)), ANSWER_BANK_AUDIO_DIR, TTS_CACHE_DIR]
+DOWNLOAD_EXTENSIONS = {".mp3", ".ogg", ".m4a"}
+
 @app.route('/download/<filename>')
 def download_file(filename):
+    """Serve generated audio with Range support for progressive playback.
+
+    MP3s are transcoded to Opus or AAC when the client asks via ?format=opus|aac
+    or advertises support in its Accept header; transcodes are cached on disk.
+    """
     try:
         # Make sure the filename is safe
-        print("Filename received for download:", filename)
         safe_filename = secure_filename(filename)
-        
-        # Create the full path to the file in the CURRENT directory
-        file_path = os.path.join(os.path.dirname(__file__), safe_filename)
-        
-        print(f"Looking for file at: {file_path}")
-        
-        # Check if the file exists
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
-            # List files in current directory for debugging
-            current_dir = os.path.dirname(__file__)
-            print(f"Files in current directory: {os.listdir(current_dir)}")
+        if os.path.splitext(safe_filename)[1].lower() not in DOWNLOAD_EXTENSIONS:
+            return "File not found", 404
+        file_path = next(
+            (os.path.join(folder, safe_filename) for folder in DOWNLOAD_FOLDERS
+             if os.path.isfile(os.path.join(folder, safe_filename))),
+            None
+        )
+        if file_path is None:
+            print(f"File not found for download: {safe_filename}")
             return "File not found", 404
-        
-        print(f"File found: {file_path}")
-        
-        # Send the file with correct headers for audio playback
-        return send_file(
-            file_path, 
+
+        mimetype = None
+        if file_path.endswith(".mp3"):
+            audio_format = negotiate_audio_format(request.args.get('format'), request.headers.get('Accept'))
+            file_path, mimetype = transcoded_audio(file_path, audio_format)
+
+        # conditional=True answers Range requests with 206 Partial Content and
+        # If-None-Match/If-Modified-Since with 304
+        response = send_file(
+            file_path,
+            mimetype=mimetype,
             as_attachment=False,  # Don't force download, allow playback
-            mimetype='audio/mpeg',  # Set correct MIME type for MP3
-            conditional=True  # Enable conditional requests (304 responses)
+            conditional=True
         )
-        
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.vary.add('Accept')
+        return response
+
     except Exception as e:
         print(f"Error in download endpoint: {str(e)}")
         traceback.print_exc()
         return "Error downloading file", 500
-    
+
+@app.after_request
+def compress_json(response):
+    return compress_response(response, request.headers.get('Accept-Encoding'))
+
 
 @app.route('/process', methods=['POST'])
 def process():
-    agent = create_main_agent()
-
     # Retrieve files and text
     audio_file = request.files.get('audio')
     image_file = request.files.get('image')
     query_text = request.form.get('query_text', '')
+    session_id = request.headers.get('X-Session-ID') or request.form.get('session_id', '')
+
+    # A client retry carrying the same Idempotency-Key replays the earlier result, even
+    # when it lands on a different worker. This runs before triage and rate limiting
+    # so a retry of a completed consultation is never refused
+    idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if idempotency_key:
+        idempotency_key = fingerprint("idempotency", session_id, idempotency_key)
+        response = cache_get("answers", idempotency_key)
+        if response is not None:
+            return jsonify(response)
+
+    # Sessions keep their history in the SQLite checkpointer; anonymous calls stay stateless
+    agent = get_agent(with_sessions=bool(session_id))
+    config = {"configurable": {"thread_id": session_id}} if session_id else None
 
     audio_filepath = ""
     image_filepath = ""
 
     # Save uploaded files
     if audio_file:
-        filename = secure_filename(audio_file.filename)
-        audio_filepath = os.path.join(UPLOAD_FOLDER, filename)
-        audio_file.save(audio_filepath)
+        audio_filepath = save_upload(audio_file)
 
     if image_file:
-        filename = secure_filename(image_file.filename)
-        image_filepath = os.path.join(UPLOAD_FOLDER, filename)
-        image_file.save(image_filepath)
+        image_filepath = save_upload(image_file)
 
-    # Prepare inputs
+    # Prepare inputs; per-turn outputs are reset so a session never returns the previous answer's audio
     inputs = {
         "audio_filepath": audio_filepath,
         "image_filepath": image_filepath,
-        "query_text": query_text
+        "query_text": query_text,
+        "speech_to_text": None,
+        "doctor_response": None,
+        "voice_of_doctor": None,
+        "branch_timings": None,
+        "context_stats": None,
+        "speculation_id": None,
+        "next_node": None
     }
-    
-    
-    
 
-    # Process with agent
-    result = agent.invoke(inputs)
+    # Triage on the typed text. Audio is only transcribed by the graph inside the
+    # scheduled job, so throttled and shed requests never cost a Whisper call
+    priority = detect_urgency(query_text)
 
-    # Prepare paths for audio output if generated
-    voice_of_doctor_path = result.get("voice_of_doctor", "")
-    if voice_of_doctor_path and os.path.exists(voice_of_doctor_path):
-        # Return URL path to the file
-        voice_url = f"/download/{os.path.basename(voice_of_doctor_path)}"
-    else:
-        voice_url = ""
+    # Urgent consultations are never rate limited or shed. Limits are keyed on the
+    # peer address: session ids and headers are chosen by the client and would let
+    # it mint a fresh bucket per call
+    if priority != URGENT:
+        allowed, retry_after = get_rate_limiter().allow(request.remote_addr)
+        if not allowed:
+            get_scheduler().count("rate_limited")
+            response = jsonify({"error": "Too many requests, please slow down."})
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response, 429
+
+    def run_scheduled():
+        return get_scheduler().submit(priority, agent.invoke, inputs, config).result()
+
+    # Process with agent; identical concurrent consultations share one graph run,
+    # and concurrent retries with the same Idempotency-Key join the first one
+    work_key = fingerprint(session_id, query_text, file_digest(audio_filepath), file_digest(image_filepath))
+    try:
+        if idempotency_key:
+            result = idempotency_flight.do(idempotency_key, graph_flight.do, work_key, run_scheduled)
+        else:
+            result = graph_flight.do(work_key, run_scheduled)
+    except Overloaded:
+        # Shed: answer right away from the bank or a template instead of queueing
+        result = {"speech_to_text": query_text.strip(), **shed_response(priority, query_text)}
+        response = jsonify({**result, "voice_of_doctor": voice_url(result["voice_of_doctor"])})
+        response.headers['Retry-After'] = "30"
+        return response
 
     response = {
         "speech_to_text": result.get("speech_to_text", ""),
         "doctor_response": result.get("doctor_response", ""),
-        "voice_of_doctor": voice_url
+        "voice_of_doctor": voice_url(result.get("voice_of_doctor", "")),
+        "priority": PRIORITY_NAMES[priority]
     }
+    if result.get("branch_timings"):
+        response["branch_timings"] = result["branch_timings"]
+    if result.get("context_stats"):
+        response["context_stats"] = result["context_stats"]
+    if session_id:
+        response["session_id"] = session_id
+    if idempotency_key:
+        cache_set("answers", idempotency_key, response)
 
     return jsonify(response)
 
-@app.route('/download/<filename>', methods=['GET'])
-def download(filename):
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
-    return "File not found", 404
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """Process many consultations in one call.
+
+    Accepts either JSON {"items": [{"query_text": ...}, ...], "with_voice": false}
+    or multipart form fields query_text_<i>, audio_<i> and image_<i> with a
+    "count" field. Results are returned in input order with per-item errors.
+    """
+    items = []
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        with_voice = bool(payload.get("with_voice", False))
+        for item in payload.get("items", []):
+            items.append({
+                "audio_filepath": "",
+                "image_filepath": "",
+                "query_text": item.get("query_text", "")
+            })
+    else:
+        with_voice = request.form.get("with_voice", "").lower() in ("1", "true", "yes")
+        try:
+            count = int(request.form.get("count", "0"))
+        except ValueError:
+            return jsonify({"error": "count must be an integer"}), 400
+        for i in range(count):
+            audio_file = request.files.get(f"audio_{i}")
+            image_file = request.files.get(f"image_{i}")
+            items.append({
+                "audio_filepath": save_upload(audio_file) if audio_file else "",
+                "image_filepath": save_upload(image_file) if image_file else "",
+                "query_text": request.form.get(f"query_text_{i}", "")
+            })
+
+    if not items:
+        return jsonify({"error": "No items provided"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} items per batch"}), 400
+
+    results = invoke_batch(items, with_voice=with_voice)
+    for result in results:
+        result["voice_of_doctor"] = voice_url(result.get("voice_of_doctor", ""))
+
+    return jsonify({"results": results})
+
+# ------------------ Admin diagnostics ------------------
+def require_admin(view):
+    """Allow only requests carrying ADMIN_TOKEN (X-Admin-Token or Authorization: Bearer)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return "Not found", 404
+        token = request.headers.get('X-Admin-Token')
+        if not token and request.headers.get('Authorization', '').startswith('Bearer '):
+            token = request.headers['Authorization'][len('Bearer '):]
+        if not admin_authorized(token):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics/scheduler')
+@require_admin
+def scheduler_metrics():
+    """Queue depth, wait times, shed and rate-limited counts for this worker"""
+    return jsonify({"pid": os.getpid(), **get_scheduler().metrics()})
+
+@app.route('/metrics/speculation')
+@require_admin
+def speculation_metrics():
+    """Speculative retrieval launched/used/discarded counts and latency saved per route"""
+    return jsonify({"pid": os.getpid(), **speculation_stats()})
+
+@app.route('/admin/diagnostics')
+@require_admin
+def admin_diagnostics():
+    """RSS, threads, open file descriptors and per-cache sizes for this worker"""
+    return jsonify(diagnostics_report())
+
+@app.route('/admin/profile', methods=['POST'])
+@require_admin
+def admin_profile():
+    """Sample live stacks for ?seconds= and return collapsed stacks (or ?format=json)"""
+    try:
+        profile = sample_profile(
+            seconds=request.args.get('seconds', 5, type=float),
+            interval_ms=request.args.get('interval_ms', 10, type=float),
+            active_only=request.args.get('active_only', '1') != '0'
+        )
+    except ProfilerBusy:
+        return jsonify({"error": "A profile is already running in this worker"}), 409
+
+    if request.args.get('format') == 'json':
+        stacks = profile.pop("stacks")
+        limit = request.args.get('limit', 100, type=int)
+        return jsonify({
+            "pid": os.getpid(),
+            **profile,
+            "stacks": [{"stack": stack, "count": count} for stack, count in stacks.most_common(limit)]
+        })
+    return Response(format_collapsed(profile["stacks"]), mimetype="text/plain")
+
+@app.route('/admin/tracemalloc/<action>', methods=['POST'])
+@require_admin
+def admin_tracemalloc(action):
+    """start, snapshot (top sites plus diff against the previous snapshot) or stop"""
+    if action == "start":
+        return jsonify(tracemalloc_start())
+    if action == "snapshot":
+        return jsonify(tracemalloc_snapshot(limit=request.args.get('limit', 25, type=int)))
+    if action == "stop":
+        return jsonify(tracemalloc_stop())
+    return jsonify({"error": f"Unknown action {action}"}), 400
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
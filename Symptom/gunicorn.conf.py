@@ -0,0 +1,19 @@
+# Production server: gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+# Production opens the persisted indexes instead of re-ingesting on start
+os.environ.setdefault("RAG_REUSE_INDEX", "1")
+
+from production import WEB_WORKERS, WEB_THREADS, after_fork
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = WEB_WORKERS
+worker_class = "gthread"
+threads = WEB_THREADS
+preload_app = True  # models and indexes load once in the master and are shared copy-on-write
+timeout = int(os.getenv("WEB_TIMEOUT", "180"))  # consultations can run multi-second pipelines
+graceful_timeout = 30
+
+
+def post_fork(server, worker):
+    after_fork(server, worker)
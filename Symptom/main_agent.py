@@ -1,8 +1,19 @@
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, Optional
+from typing import TypedDict, Optional, List, Annotated
 from symptom_agent.symptom_agent import create_symptom_agent
+from symptom_agent.fusion_agent import FUSION_ENABLED
 from preventive_agent.preventive_measure_agent import create_preventive_measure_agent
+from request_coalescing import fingerprint, file_digest, llm_flight
+from session_memory import append_turns, build_context, record_turn
+from answer_bank import answer_bank, KIND_BY_NODE
+from shared_cache import cached
+from speculation import speculate, discard
+from concurrent.futures import ThreadPoolExecutor
 import os
+import uuid
+
+# Upper bound on concurrent upstream calls (LLM, search, TTS) made by one batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
 
 # Define the structure of the agent's state
 class AgentState(TypedDict):
@@ -14,45 +25,152 @@ class AgentState(TypedDict):
     voice_of_doctor: Optional[str]
     requires_symptom_analysis: bool
     next_node: Optional[str]  # Track the next node
-    
+    history: Annotated[List[dict], append_turns]  # Recent turns, persisted per session
+    conversation_context: Optional[str]  # Summary + recent turns for follow-up questions
+    branch_timings: Optional[dict]  # Vision/RAG/synthesis seconds from the fused path
+    context_stats: Optional[dict]  # Tokens the context builder saved for this answer
+    speculation_id: Optional[str]  # Per-request key of the retrieval started while routing
+
+# Longest user or assistant text stored per turn in the session history
+MAX_TURN_CHARS = 600
+
+CLASSIFIER_PROMPT = (
+    "You are a medical assistant that categorizes user queries into one of the following types:\n"
+    "1. symptom — queries about medical symptoms, diseases, or health issues.\n"
+    "2. preventive — queries about prevention, tips, remedies, or staying healthy.\n"
+    "3. general — all other queries not related to symptoms or prevention.\n"
+)
+
+ROUTES = {
+    "symptom": "symptom_agent",
+    "preventive": "preventive_measure_agent",
+    "general": "general_response"
+}
+
+
+def _prefetch_symptom(query):
+    from symptom_agent.rag_agent import retrieve
+    return retrieve(query)
+
+
+def _prefetch_preventive(query):
+    from preventive_agent.preventive_rag_agent import lookup_preventive_index
+    return lookup_preventive_index(query)
+
+
+# Retrieval each route would do first, started speculatively while the classifier runs
+SPECULATIVE_BRANCHES = {
+    "symptom_agent": _prefetch_symptom,
+    "preventive_measure_agent": _prefetch_preventive
+}
+
+
+def with_context(state, text):
+    """Prefix a prompt with the session's conversation context, if any"""
+    context = state.get("conversation_context")
+    if not context:
+        return text
+    return f"{context}\n\nCurrent message:\n{text}"
+
+
+def load_context(state: AgentState, config):
+    """Build the token-budgeted conversation context for this session"""
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    return {"conversation_context": build_context(thread_id, state.get("history") or [])}
+
+
+def remember(state: AgentState, config):
+    """Append this consultation to the session history and schedule summarization"""
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    if not thread_id:
+        return {}
+
+    history = state.get("history") or []
+    turn = {
+        "index": history[-1]["index"] + 1 if history else 0,
+        "user": (state.get("speech_to_text") or state.get("query_text") or "")[:MAX_TURN_CHARS],
+        "assistant": (state.get("doctor_response") or "")[:MAX_TURN_CHARS]
+    }
+    record_turn(thread_id, append_turns(history, [turn]))
+    return {"history": [turn]}
+
 
 def route_inputs(state: AgentState):
     """Use LLM classification to decide the next node"""
+    return classify_route(state, speculative=True)
+
+
+def classify_route(state, speculative=False):
+    """Classify one consultation; with speculative, start each route's retrieval meanwhile.
+
+    Batches pass speculative=False: they retrieve for the whole batch themselves
+    and would never claim the speculated results.
+    """
     from groq import Groq
 
     query = state.get("query_text", "") or state.get("speech_to_text", "")
 
-    client = Groq()
-    response = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are a medical assistant that categorizes user queries into one of the following types:\n"
-                    "1. symptom — queries about medical symptoms, diseases, or health issues.\n"
-                    "2. preventive — queries about prevention, tips, remedies, or staying healthy.\n"
-                    "3. general — all other queries not related to symptoms or prevention.\n"
-                    "Respond only with one of these words."
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Categorize this query:\n{query}"
-            }
-        ],
-        model="llama-3.1-8b-instant"
-    )
+    # Start each route's retrieval now, keyed by the text the agents will search with.
+    # Without fusion, image consultations go to the vision agent alone, which doesn't
+    # use symptom retrieval
+    agent_query = state.get("speech_to_text") or state.get("query_text", "")
+    speculation_id = uuid.uuid4().hex if speculative else None
+    if speculative:
+        branches = dict(SPECULATIVE_BRANCHES)
+        if state.get("image_filepath") and not FUSION_ENABLED:
+            branches.pop("symptom_agent")
+        speculate(branches, agent_query, speculation_id)
+
+    def classify():
+        client = Groq()
+        return client.chat.completions.create(
+            messages=[
+                {
+                    "role": "system",
+                    "content": CLASSIFIER_PROMPT + "Respond only with one of these words."
+                },
+                {
+                    "role": "user",
+                    "content": with_context(state, f"Categorize this query:\n{query}")
+                }
+            ],
+            model="llama-3.1-8b-instant"
+        )
+
+    response = llm_flight.do(fingerprint("classify", query, state.get("conversation_context", "")), classify)
 
     classification = response.choices[0].message.content.strip().lower()
     print("CLASSIFICATION =======", classification)
 
-    switch = {
-        "symptom": {"next_node": "symptom_agent"},
-        "preventive": {"next_node": "preventive_measure_agent"},
-        "general": {"next_node": "general_response"}
-    }
+    next_node = ROUTES.get(classification, "general_response")
+    if speculative:
+        discard(agent_query, speculation_id, keep=next_node)
+    return {"next_node": next_node, "speculation_id": speculation_id}
+
 
-    return switch.get(classification, {"next_node": "general_response"})
+def serve_from_answer_bank(state: AgentState):
+    """Answer from the precomputed bank when the query is a close match to a vetted entry"""
+    kind = KIND_BY_NODE.get(state.get("next_node"))
+    # Follow-ups need the session's history, which a canned answer ignores
+    if not kind or state.get("image_filepath") or state.get("history"):
+        return {}
+
+    query = state.get("speech_to_text") or state.get("query_text", "")
+    try:
+        entry, similarity = answer_bank.lookup(kind, query)
+    except Exception as e:
+        print(f"Answer bank lookup failed: {e}")
+        return {}
+    if not entry:
+        return {}
+
+    discard(query, state.get("speculation_id"))  # the prefetched retrieval for this route won't be needed
+    print(f"[answer bank] Served {kind}:{entry['disease']} (similarity {similarity:.2f})")
+    return {
+        "doctor_response": entry["answer"],
+        "voice_of_doctor": entry["audio_path"] or None,
+        "next_node": "remember"
+    }
 
 
 def transcribe_audio(state: AgentState):
@@ -61,10 +179,15 @@ def transcribe_audio(state: AgentState):
 
     if state.get("audio_filepath"):
         try:
-            speech_to_text = transcribe_with_groq(
-                GROQ_API_KEY=os.environ.get("GROQ_API_KEY"),
-                audio_filepath=state["audio_filepath"],
-                stt_model="whisper-large-v3"
+            # Transcripts are shared across workers, keyed by the audio content
+            speech_to_text = cached(
+                "transcripts",
+                fingerprint("whisper-large-v3", file_digest(state["audio_filepath"])),
+                lambda: transcribe_with_groq(
+                    GROQ_API_KEY=os.environ.get("GROQ_API_KEY"),
+                    audio_filepath=state["audio_filepath"],
+                    stt_model="whisper-large-v3"
+                )
             )
             return {"speech_to_text": speech_to_text}
         except Exception as e:
@@ -83,63 +206,227 @@ def general_response(state: AgentState):
         return {"doctor_response": "Please ask a question or describe your symptoms."}
 
     try:
-        client = Groq()
-        response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a helpful medical assistant. Answer general health questions but defer to doctors for specific symptoms. "
-                        "Be concise and helpful."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": query
-                }
-            ],
-            model="llama-3.1-8b-instant"
+        def answer():
+            client = Groq()
+            return client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "You are a helpful medical assistant. Answer general health questions but defer to doctors for specific symptoms. "
+                            "Be concise and helpful."
+                        )
+                    },
+                    {
+                        "role": "user",
+                        "content": with_context(state, query)
+                    }
+                ],
+                model="llama-3.1-8b-instant"
+            )
+
+        key = fingerprint("general", query, state.get("conversation_context", ""))
+        doctor_response = cached(
+            "answers", key,
+            lambda: llm_flight.do(key, answer).choices[0].message.content
         )
-        return {"doctor_response": response.choices[0].message.content}
+        return {"doctor_response": doctor_response}
     except Exception as e:
         print(f"Error during general response: {e}")
         return {"doctor_response": "I'm having trouble processing your request right now."}
 
 
-def create_main_agent():
-    """Create the main agent workflow"""
+def create_main_agent(checkpointer=None):
+    """Create the main agent workflow.
+
+    Pass a checkpointer (see session_memory.get_checkpointer) and invoke with
+    config={"configurable": {"thread_id": session_id}} to keep multi-turn sessions.
+    """
     workflow = StateGraph(AgentState)
 
     # Add nodes
     workflow.add_node("transcribe", transcribe_audio)
+    workflow.add_node("load_context", load_context)
     workflow.add_node("route", route_inputs)
     workflow.add_node("symptom_agent", create_symptom_agent())
     workflow.add_node("preventive_measure_agent", create_preventive_measure_agent())
     workflow.add_node("general_response", general_response)
+    workflow.add_node("answer_bank", serve_from_answer_bank)
+    workflow.add_node("remember", remember)
 
     # Set entry point
     workflow.set_entry_point("transcribe")
 
     # Add edges
-    workflow.add_edge("transcribe", "route")
+    workflow.add_edge("transcribe", "load_context")
+    workflow.add_edge("load_context", "route")
+    workflow.add_edge("route", "answer_bank")
 
-    # Conditional routing based on next_node field
+    # Conditional routing based on next_node field; a bank hit goes straight to "remember"
     workflow.add_conditional_edges(
-        "route",
+        "answer_bank",
         lambda state: state.get("next_node", "general_response"),
         {
             "symptom_agent": "symptom_agent",
             "preventive_measure_agent": "preventive_measure_agent",
-            "general_response": "general_response"
+            "general_response": "general_response",
+            "remember": "remember"
         }
     )
 
-    # End states
-    workflow.add_edge("symptom_agent", END)
-    workflow.add_edge("preventive_measure_agent", END)
-    workflow.add_edge("general_response", END)
+    # Record the turn, then end
+    workflow.add_edge("symptom_agent", "remember")
+    workflow.add_edge("preventive_measure_agent", "remember")
+    workflow.add_edge("general_response", "remember")
+    workflow.add_edge("remember", END)
+
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def classify_queries_batch(queries):
+    """Classify a whole batch of queries with one LLM call, returning next_node per query"""
+    from groq import Groq
+
+    if not queries:
+        return []
+
+    numbered = "\n".join(f"{i + 1}. {query}" for i, query in enumerate(queries))
+    client = Groq()
+    response = client.chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": CLASSIFIER_PROMPT + (
+                    "You will receive a numbered list of queries. Respond with one line per query "
+                    "in the form '<number>: <type>' and nothing else."
+                )
+            },
+            {
+                "role": "user",
+                "content": f"Categorize these queries:\n{numbered}"
+            }
+        ],
+        model="llama-3.1-8b-instant"
+    )
+
+    routes = ["general_response"] * len(queries)
+    for line in response.choices[0].message.content.strip().splitlines():
+        number, _, label = line.partition(":")
+        number = number.strip().rstrip(".")
+        if number.isdigit() and 0 < int(number) <= len(queries):
+            routes[int(number) - 1] = ROUTES.get(label.strip().lower(), "general_response")
+    print("BATCH CLASSIFICATION =======", routes)
+    return routes
+
+
+def invoke_batch(items, with_voice=False):
+    """Process many consultations at once, grouping the work by route.
+
+    Audio is transcribed in parallel, the batch is classified in one LLM call and
+    all text-only symptom queries are embedded in one encode call. Remaining LLM
+    work fans out on one pool of BATCH_CONCURRENCY workers. Results come back in
+    input order, each with an "error" field that is empty on success.
+    """
+    from symptom_agent.image_voice_agent import analyze_image
+    from symptom_agent.fusion_agent import fuse_analysis
+    from symptom_agent.rag_agent import retrieve_documents_batch, answer_with_context
+    from preventive_agent.preventive_rag_agent import create_preventive_rag_agent
+    from preventive_agent.preventive_youtube_agent import create_preventive_youtube_agent
+    from preventive_agent.preventive_measure_agent import (
+        asks_for_prevention, compose_preventive_response, UNSPECIFIED_PREVENTION_RESPONSE
+    )
+    from voice_of_the_doctor import speech_file
+
+    states = [dict(item) for item in items]
+    results = [{"speech_to_text": "", "doctor_response": "", "voice_of_doctor": "", "error": ""} for _ in states]
 
-    return workflow.compile()
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        # ---- Transcribe in parallel ----
+        for state, transcript in zip(states, executor.map(transcribe_audio, states)):
+            state.update(transcript)
+        queries = [state.get("speech_to_text") or state.get("query_text", "") for state in states]
+
+        # ---- Classify the whole batch in one pass ----
+        try:
+            routes = classify_queries_batch(queries)
+        except Exception as e:
+            print(f"Batch classification failed, classifying individually: {e}")
+            classified = [executor.submit(classify_route, state) for state in states]
+            routes = []
+            for i, future in enumerate(classified):
+                try:
+                    routes.append(future.result()["next_node"])
+                except Exception as item_error:
+                    results[i]["error"] = f"Classification failed: {item_error}"
+                    routes.append(None)
+
+        # ---- Embed all text-only symptom queries together ----
+        rag_indexes = [
+            i for i, route in enumerate(routes)
+            if route == "symptom_agent" and not states[i].get("image_filepath") and queries[i]
+            and not results[i]["error"]
+        ]
+        retrieved = {}
+        try:
+            for i, hit in zip(rag_indexes, retrieve_documents_batch([queries[i] for i in rag_indexes])):
+                retrieved[i] = hit
+        except Exception as e:
+            print(f"Batch retrieval failed: {e}")
+            for i in rag_indexes:
+                results[i]["error"] = f"Retrieval failed: {e}"
+
+        # Preventive items call the sub-agents directly: the full agent renders its
+        # own TTS into final.mp3, which concurrent items would overwrite
+        preventive_rag = preventive_youtube = None
+        if "preventive_measure_agent" in routes:
+            preventive_rag = create_preventive_rag_agent()
+            preventive_youtube = create_preventive_youtube_agent()
+
+        def run_item(i):
+            state, route = states[i], routes[i]
+            banked = serve_from_answer_bank({**state, "next_node": route})
+            if banked:
+                return banked["doctor_response"]
+            if route == "symptom_agent" and state.get("image_filepath"):
+                if FUSION_ENABLED and queries[i]:
+                    return fuse_analysis(state)["doctor_response"]
+                return analyze_image(state)["doctor_response"]
+            if route == "symptom_agent":
+                if not queries[i]:
+                    return "Please provide a question or description of your symptoms."
+                docs, query_vector, doc_vectors = retrieved[i]
+                return answer_with_context(queries[i], docs, query_vector=query_vector, doc_vectors=doc_vectors)[0]
+            if route == "preventive_measure_agent":
+                if not asks_for_prevention(queries[i]):
+                    return UNSPECIFIED_PREVENTION_RESPONSE
+                return compose_preventive_response(
+                    preventive_rag(state).get("rag_response"), preventive_youtube(state).get("youtube_response")
+                )
+            return general_response(state)["doctor_response"]
+
+        # ---- Fan out answers on the shared pool ----
+        pending = {
+            i: executor.submit(run_item, i)
+            for i in range(len(states)) if not results[i]["error"]
+        }
+        for i, future in pending.items():
+            results[i]["speech_to_text"] = states[i].get("speech_to_text", "")
+            try:
+                results[i]["doctor_response"] = future.result()
+            except Exception as e:
+                print(f"Batch item {i} failed: {e}")
+                results[i]["error"] = str(e)
 
+        # ---- Optional voice, served straight from the size-capped TTS cache ----
+        if with_voice:
+            def speak(i):
+                return speech_file(results[i]["doctor_response"])
 
+            voiced = {i: executor.submit(speak, i) for i in pending if results[i]["doctor_response"]}
+            for i, future in voiced.items():
+                try:
+                    results[i]["voice_of_doctor"] = future.result()
+                except Exception as e:
+                    print(f"Voice generation failed for batch item {i}: {e}")
 
+    return results
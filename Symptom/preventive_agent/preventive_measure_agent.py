@@ -8,6 +8,22 @@ from voice_of_the_doctor import text_to_speech_with_elevenlabs
 from .preventive_rag_agent import create_preventive_rag_agent
 from .preventive_youtube_agent import create_preventive_youtube_agent
 
+def compose_preventive_response(rag_response, youtube_response):
+    """Format the web answer and YouTube links the way the app displays them"""
+    return (
+        "Here are some preventive measures:\n\n"
+        "From the web:\n"
+        f"{rag_response}\n\n"
+        "YouTube links:\n"
+        f"{youtube_response}"
+    )
+
+PREVENTIVE_KEYWORDS = ["prevent", "prevention", "avoid", "reduce risk", "stay healthy", "tips"]
+UNSPECIFIED_PREVENTION_RESPONSE = "Please specify what you want to prevent or ask for preventive tips."
+
+def asks_for_prevention(query):
+    return any(word in query.lower() for word in PREVENTIVE_KEYWORDS)
+
 def create_preventive_measure_agent():
     """Main preventive measure agent that integrates RAG and YouTube agents with voice response."""
 
@@ -17,10 +33,8 @@ def create_preventive_measure_agent():
     def preventive_measure_agent(state):
         query = state.get("speech_to_text", state.get("query_text", ""))
         
-        preventive_keywords = ["prevent", "prevention", "avoid", "reduce risk", "stay healthy", "tips"]
-        
-        if not any(word in query.lower() for word in preventive_keywords):
-            response_text = "Please specify what you want to prevent or ask for preventive tips."
+        if not asks_for_prevention(query):
+            response_text = UNSPECIFIED_PREVENTION_RESPONSE
             voice_of_doctor = None
             return {
                 "doctor_response": response_text,
@@ -32,12 +46,9 @@ def create_preventive_measure_agent():
         rag_result = rag_agent(state)
         youtube_result = youtube_agent(state)
 
-        response_text = (
-            "Here are some preventive measures:\n\n"
-            "From the web:\n"
-            f"{rag_result.get('rag_response')}\n\n"
-            "YouTube links:\n"
-            f"{youtube_result.get('youtube_response')}"
+        response_text = compose_preventive_response(
+            rag_result.get('rag_response'),
+            youtube_result.get('youtube_response')
         )
 
         try:
@@ -52,7 +63,8 @@ def create_preventive_measure_agent():
         return {
             "doctor_response": response_text,
             "image_filepath": None,
-            "voice_of_doctor": voice_of_doctor
+            "voice_of_doctor": voice_of_doctor,
+            "context_stats": rag_result.get("context_stats")
         }
 
     return preventive_measure_agent
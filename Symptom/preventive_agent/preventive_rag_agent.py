@@ -1,12 +1,18 @@
 import os
 import json
 import http.client
+import numpy as np
 from dotenv import load_dotenv
 
 from langchain_groq import ChatGroq
-from langchain.embeddings import SentenceTransformerEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from quantized_store import QuantizedMmapVectorStore
+from context_builder import assemble_context, CONTEXT_FETCH_K
+from request_coalescing import fingerprint, llm_flight, search_flight, scrape_flight
+from speculation import claim
+from symptom_agent.rag_agent import get_embeddings
 
 # ------------------ Load Environment Variables ------------------
 load_dotenv()
@@ -24,8 +30,93 @@ llm = ChatGroq(
 llm_disease = llm
 
 # ------------------ Embeddings + FAISS ------------------
-embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-vector_store = FAISS.from_texts([""], embedding_function)  # Initialize empty FAISS
+# Same MiniLM instance as the symptom RAG, so each worker loads the model once
+embedding_function = get_embeddings()
+if os.getenv("PREVENTIVE_VECTOR_BACKEND", "faiss") == "mmap":
+    # Scraped pages persist in an int8 memory-mapped store shared by all workers
+    vector_store = QuantizedMmapVectorStore(os.getenv("PREVENTIVE_MMAP_PATH", "./preventive_mmap_index"), embedding_function)
+else:
+    vector_store = FAISS.from_texts([""], embedding_function)  # Initialize empty FAISS
+
+# Pages are indexed as chunks so lookups return chunk vectors the context builder can reuse
+page_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+def _store_is_empty():
+    if isinstance(vector_store, QuantizedMmapVectorStore):
+        return len(vector_store) == 0
+    return vector_store.index is None or vector_store.index.ntotal == 0
+
+def lookup_preventive_index(query):
+    """Similarity search over already scraped chunks, returning (docs, stored vectors); empty when nothing is indexed"""
+    if _store_is_empty():
+        return [], []
+    query_vector = embedding_function.embed_query(query)
+    if isinstance(vector_store, QuantizedMmapVectorStore):
+        hits = vector_store.similarity_search_with_vectors_by_vector(query_vector, k=CONTEXT_FETCH_K)
+    else:
+        _, rows = vector_store.index.search(np.asarray([query_vector], dtype=np.float32), CONTEXT_FETCH_K)
+        hits = [
+            (vector_store.docstore.search(vector_store.index_to_docstore_id[int(i)]), vector_store.index.reconstruct(int(i)))
+            for i in rows[0] if i >= 0
+        ]
+    # Skip the blank placeholder FAISS is initialised with
+    hits = [(doc, vector) for doc, vector in hits if doc.page_content.strip()]
+    return [doc for doc, _ in hits], [vector for _, vector in hits]
+
+# ------------------ Coalesced Upstream Calls ------------------
+def identify_disease(query, conversation_context=""):
+    """Ask the LLM which disease the query is about (shared with the YouTube agent)"""
+    prompt = f"Identify the disease mentioned in this query: '{query}'"
+    if conversation_context:
+        prompt = f"{conversation_context}\n\n{prompt} (use the conversation above to resolve references like 'it')"
+    response = llm_flight.do(fingerprint("disease", query, conversation_context), llm_disease.invoke, prompt)
+    return response.content.strip()
+
+def _serper_search(disease):
+    conn = http.client.HTTPSConnection("google.serper.dev")
+    payload = json.dumps({"q": f"{disease} preventive measures from wikipedia"})
+    headers = {'X-API-KEY': GOOGLE_SERPER_API_KEY, 'Content-Type': 'application/json'}
+    conn.request("POST", "/search", payload, headers)
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    return json.loads(data.decode("utf-8"))
+
+def _serper_scrape(link):
+    conn = http.client.HTTPSConnection("scrape.serper.dev")
+    formatted_url = link.replace("https://", "").replace("/", "_")
+    payload = json.dumps({"url": formatted_url})
+    headers = {'X-API-KEY': SCRAPE_SERPER_API_KEY, 'Content-Type': 'application/json'}
+    conn.request("POST", "/", payload, headers)
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    return json.loads(data.decode("utf-8"))
+
+def search_preventive_links(disease):
+    """Google Serper search for preventive pages, coalesced per disease"""
+    search_result = search_flight.do(fingerprint("search", disease), _serper_search, disease)
+    return [item.get("link") for item in search_result.get("organic", [])]
+
+def _scrape_and_index(link):
+    content = _serper_scrape(link).get("content", "")
+    if not content:
+        return [], []
+    texts = page_splitter.split_text(content)
+    vectors = embedding_function.embed_documents(texts)
+    metadatas = [{"source": link} for _ in texts]
+    if isinstance(vector_store, QuantizedMmapVectorStore):
+        vector_store.add_embeddings(texts, vectors, metadatas)
+    else:
+        vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+    return [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)], vectors
+
+def scrape_link(link):
+    """Scrape one page through Serper, chunk and index it, coalesced per URL so FAISS gets one insert.
+
+    Returns (chunk documents, their vectors).
+    """
+    return scrape_flight.do(fingerprint("scrape", link), _scrape_and_index, link)
 
 # ------------------ Factory-style RAG Agent ------------------
 def create_preventive_rag_agent():
@@ -36,30 +127,18 @@ def create_preventive_rag_agent():
             return {"rag_response": "Please provide a valid query."}
 
         # ---- Step 1: Identify Disease ----
-        prompt = f"Identify the disease mentioned in this query: '{query}'"
-        response = llm_disease.invoke(prompt)
-        disease = response.content.strip()
+        disease = identify_disease(query, state.get("conversation_context", ""))
         print(f"[Groq] Identified disease: {disease}")
 
-        # ---- Step 2: Check Existing Vector Store ----
-        if vector_store.index is None or vector_store.index.ntotal == 0:
-            docs = []
-        else:
-            docs = vector_store.similarity_search(query, k=3)
+        # ---- Step 2: Check Existing Vector Store (possibly prefetched while routing) ----
+        prefetched, hits = claim("preventive_measure_agent", query, state.get("speculation_id"))
+        docs, doc_vectors = hits if prefetched else lookup_preventive_index(query)
 
         # ---- Step 3: If not found, search & scrape ----
         if not docs:
             try:
                 # Search Google Serper
-                conn = http.client.HTTPSConnection("google.serper.dev")
-                payload = json.dumps({"q": f"{disease} preventive measures from wikipedia"})
-                headers = {'X-API-KEY': GOOGLE_SERPER_API_KEY, 'Content-Type': 'application/json'}
-                conn.request("POST", "/search", payload, headers)
-                res = conn.getresponse()
-                data = res.read()
-                search_result = json.loads(data.decode("utf-8"))
-                links = [item.get("link") for item in search_result.get("organic", [])]
-                conn.close()
+                links = search_preventive_links(disease)
                 print(f"[Google Serper] Found {len(links)} links.")
             except Exception as e:
                 return {"rag_response": f"Error during search: {e}"}
@@ -67,37 +146,29 @@ def create_preventive_rag_agent():
             # Scrape top 5 links
             for link in links[:5]:
                 try:
-                    conn = http.client.HTTPSConnection("scrape.serper.dev")
-                    formatted_url = link.replace("https://", "").replace("/", "_")
-                    payload = json.dumps({"url": formatted_url})
-                    headers = {'X-API-KEY': SCRAPE_SERPER_API_KEY, 'Content-Type': 'application/json'}
-                    conn.request("POST", "/", payload, headers)
-                    res = conn.getresponse()
-                    data = res.read()
-                    scrape_result = json.loads(data.decode("utf-8"))
-                    content = scrape_result.get("content", "")
-                    conn.close()
-                    if content:
-                        doc = Document(page_content=content, metadata={"source": link})
-                        vector_store.add_documents([doc])
-                        docs.append(doc)
+                    chunks, vectors = scrape_link(link)
+                    docs.extend(chunks)
+                    doc_vectors.extend(vectors)
                     print(f"[Scrape Serper] Scraped content from {link}")
                 except Exception as e:
                     print(f"Error scraping {link}: {e}")
 
         # ---- Step 4: Generate Augmented Response ----
         if docs:
-            context_text = "\n\n".join([doc.page_content for doc in docs])
+            # Scraped pages can be tens of thousands of tokens; keep only what fits the budget,
+            # reusing the vectors computed when the chunks were indexed
+            context_text, context_stats = assemble_context(query, docs, embedding_function, doc_vectors=doc_vectors)
             prompt = (
                 f"Using the following context, answer the question detailed:\n\n"
                 f"Context:\n{context_text}\n\n"
                 f"Question: {query}\n\nAnswer:"
             )
-            response = llm.invoke(prompt)
+            response = llm_flight.do(fingerprint("preventive-answer", prompt), llm.invoke, prompt)
             final_text = response.content.strip()
         else:
             final_text = "No relevant information found after scraping."
+            context_stats = None
 
-        return {"rag_response": final_text}
+        return {"rag_response": final_text, "context_stats": context_stats}
 
     return preventive_rag_agent
\ No newline at end of file
@@ -4,6 +4,8 @@ import http.client
 from dotenv import load_dotenv
 
 from langchain_groq import ChatGroq
+from request_coalescing import fingerprint, search_flight
+from .preventive_rag_agent import identify_disease
 
 # ------------------ Load Environment Variables ------------------
 load_dotenv()
@@ -19,6 +21,19 @@ llm = ChatGroq(
 
 llm_disease = llm
 
+# ------------------ Serper Videos Search ------------------
+def _serper_videos(disease):
+    conn = http.client.HTTPSConnection("google.serper.dev")
+    payload = json.dumps({
+        "q": f"preventive health tips for {disease} site:youtube.com"
+    })
+    headers = {'X-API-KEY': GOOGLE_SERPER_API_KEY, 'Content-Type': 'application/json'}
+    conn.request("POST", "/videos", payload, headers)
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    return json.loads(data.decode("utf-8"))
+
 # ------------------ Factory-style YouTube Preventive Agent ------------------
 def create_preventive_youtube_agent():
 
@@ -28,25 +43,13 @@ def create_preventive_youtube_agent():
             return {"youtube_response": "Please provide a valid query."}
 
         # ---- Step 1: Identify Disease ----
-        prompt = f"Identify the disease mentioned in this query: '{query}'"
-        response = llm_disease.invoke(prompt)
-        disease = response.content.strip()
+        disease = identify_disease(query, state.get("conversation_context", ""))
         print(f"[Groq] Identified disease: {disease}")
 
         # ---- Step 2: Search YouTube via Google Serper ----
         try:
-            conn = http.client.HTTPSConnection("google.serper.dev")
-            payload = json.dumps({
-                "q": f"preventive health tips for {disease} site:youtube.com"
-            })
-            headers = {'X-API-KEY': GOOGLE_SERPER_API_KEY, 'Content-Type': 'application/json'}
-            conn.request("POST", "/videos", payload, headers)
-            res = conn.getresponse()
-            
-            data = res.read()
-            result = json.loads(data.decode("utf-8"))
+            result = search_flight.do(fingerprint("videos", disease), _serper_videos, disease)
             print("Youtube ============================= ",result)
-            conn.close()
 
             videos = []
             # Updated key to 'videos' for Serper Videos API
@@ -0,0 +1,54 @@
+"""Preloading and fork hooks for the multi-worker production server.
+
+Heavy, read-only state (embedding models, the BM25 index, the memory-mapped
+vector store and the answer bank) is loaded once in the gunicorn master before
+fork, so workers share those pages copy-on-write. Anything holding a SQLite
+connection (Chroma, the session checkpointer, the shared cache) is opened lazily
+inside each worker instead, since SQLite handles must not cross a fork.
+"""
+import os
+import time
+
+from scheduler import SCHEDULER_WORKERS, limit_queue
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "16"))
+# Every admitted non-urgent consultation holds a web thread while it runs or waits in
+# the scheduler queue. The queue is capped to what the threads can hold, keeping
+# WEB_THREAD_HEADROOM free for urgent requests, downloads and metrics; anything past
+# the cap is shed at admission rather than parked on a thread
+WEB_THREAD_HEADROOM = int(os.getenv("WEB_THREAD_HEADROOM", "4"))
+limit_queue(WEB_THREADS - SCHEDULER_WORKERS - WEB_THREAD_HEADROOM)
+# Intra-op torch threads per worker so workers don't oversubscribe the cores
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // WEB_WORKERS))))
+
+
+def preload():
+    """Load shared models and indexes in the master process"""
+    import torch
+
+    # A single thread in the master keeps torch from starting an OpenMP pool,
+    # which would deadlock the first parallel region in every forked worker
+    torch.set_num_threads(1)
+    start = time.perf_counter()
+
+    import main_agent  # noqa: F401  (imports the agents and their embedding models)
+    from symptom_agent import rag_agent
+    from answer_bank import answer_bank
+
+    rag_agent.get_embeddings()
+    if rag_agent.VECTOR_BACKEND == "mmap":
+        rag_agent.get_vectorstore()
+    if os.path.exists(rag_agent.BM25_INDEX_PATH):
+        rag_agent.get_bm25_index()
+    answer_bank._maybe_reload()
+
+    print(f"[production] Preloaded models and indexes in {time.perf_counter() - start:.1f}s")
+
+
+def after_fork(server, worker):
+    """Per-worker setup run by gunicorn right after fork"""
+    import torch
+
+    torch.set_num_threads(TORCH_THREADS)
+    server.log.info(f"Worker {worker.pid} ready with {TORCH_THREADS} torch threads")
@@ -0,0 +1,203 @@
+import os
+import json
+import numpy as np
+from contextlib import contextmanager
+from langchain_core.vectorstores import VectorStore
+from langchain.schema import Document
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only safe from a single process
+    fcntl = None
+
+# ------------------ On-disk layout ------------------
+# <path>/meta.json     {"dim": D}
+# <path>/vectors.i8    N x D int8, each row a unit vector scaled to [-127, 127]
+# <path>/scales.f32    N float32 per-row dequantization scales
+# <path>/offsets.u64   N x 2 uint64 (start, length) into records.bin
+# <path>/records.bin   concatenated UTF-8 JSON {"text": ..., "metadata": ...}
+#
+# Every file is opened read-only through np.memmap, so worker processes that open
+# the same index share its pages through the OS page cache instead of each holding
+# float32 vectors and chunk text on the heap. Appends from several processes are
+# serialized with a lock file, and readers remap when another process has grown the index.
+SEARCH_BLOCK_ROWS = 65536  # rows dequantized at a time, keeps scoring memory flat
+
+
+def _quantize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None) / 127.0
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class QuantizedMmapVectorStore(VectorStore):
+    """int8-quantized, memory-mapped vector store usable wherever Chroma/FAISS were"""
+
+    def __init__(self, path, embedding):
+        self.path = path
+        self._embedding = embedding
+        os.makedirs(path, exist_ok=True)
+        self._remap()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _remap(self):
+        meta_path = self._file("meta.json")
+        self.dim = None
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        count = os.path.getsize(self._file("scales.f32")) // 4 if os.path.exists(self._file("scales.f32")) else 0
+        if not count:
+            self._vectors = np.zeros((0, self.dim or 0), dtype=np.int8)
+            self._scales = np.zeros(0, dtype=np.float32)
+            self._offsets = np.zeros((0, 2), dtype=np.uint64)
+            self._records = np.zeros(0, dtype=np.uint8)
+            return
+        self._vectors = np.memmap(self._file("vectors.i8"), dtype=np.int8, mode="r", shape=(count, self.dim))
+        self._scales = np.memmap(self._file("scales.f32"), dtype=np.float32, mode="r", shape=(count,))
+        self._offsets = np.memmap(self._file("offsets.u64"), dtype=np.uint64, mode="r", shape=(count, 2))
+        self._records = np.memmap(self._file("records.bin"), dtype=np.uint8, mode="r")
+
+    @contextmanager
+    def _write_lock(self):
+        with open(self._file(".lock"), "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        scales_path = self._file("scales.f32")
+        if os.path.exists(scales_path) and os.path.getsize(scales_path) // 4 != len(self._scales):
+            self._remap()
+
+    def __len__(self):
+        self._refresh()
+        return len(self._scales)
+
+    def _record(self, i):
+        start, length = (int(x) for x in self._offsets[i])
+        return json.loads(bytes(self._records[start:start + length]).decode("utf-8"))
+
+    def iter_records(self):
+        """Yield (text, metadata) for every stored chunk, one record at a time"""
+        for i in range(len(self)):
+            record = self._record(i)
+            yield record["text"], record["metadata"]
+
+    def _document(self, i):
+        record = self._record(i)
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    # ------------------ Writing ------------------
+    def add_embeddings(self, texts, vectors, metadatas=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        quantized, scales = _quantize(vectors)
+        with self._write_lock():
+            if self.dim is None:
+                self.dim = int(quantized.shape[1])
+                with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+
+            records_path = self._file("records.bin")
+            start = os.path.getsize(records_path) if os.path.exists(records_path) else 0
+            offsets = []
+            with open(records_path, "ab") as f:
+                for text, metadata in zip(texts, metadatas):
+                    blob = json.dumps({"text": text, "metadata": metadata}).encode("utf-8")
+                    f.write(blob)
+                    offsets.append((start, len(blob)))
+                    start += len(blob)
+
+            scales_path = self._file("scales.f32")
+            first_id = os.path.getsize(scales_path) // 4 if os.path.exists(scales_path) else 0
+            # An append interrupted before its scales landed leaves orphaned vector and
+            # offset rows (and possibly a partial scale); cut every file back to first_id
+            # rows so the new rows line up again. Orphaned records.bin bytes are harmless
+            for name, row_bytes in (("vectors.i8", self.dim), ("offsets.u64", 16), ("scales.f32", 4)):
+                path = self._file(name)
+                if os.path.exists(path) and os.path.getsize(path) > first_id * row_bytes:
+                    os.truncate(path, first_id * row_bytes)
+            with open(self._file("vectors.i8"), "ab") as f:
+                f.write(quantized.tobytes())
+            with open(self._file("offsets.u64"), "ab") as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            # scales are written last: their size defines how many rows are visible
+            with open(scales_path, "ab") as f:
+                f.write(scales.tobytes())
+
+        self._remap()
+        return [str(i) for i in range(first_id, first_id + len(texts))]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, path="./mmap_index", **kwargs):
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas)
+        return store
+
+    # ------------------ Searching ------------------
+    def _top_rows(self, embedding, k):
+        """Indexes and cosine scores of the k nearest rows, best first"""
+        self._refresh()
+        vectors, scales = self._vectors, self._scales
+        count = len(scales)
+        if not count:
+            return [], []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, count)
+            scores[start:stop] = (vectors[start:stop].astype(np.float32) @ query) * scales[start:stop]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [int(i) for i in top], [float(scores[i]) for i in top]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4):
+        rows, scores = self._top_rows(embedding, k)
+        return [(self._document(i), score) for i, score in zip(rows, scores)]
+
+    def similarity_search_with_vectors_by_vector(self, embedding, k=4):
+        """Nearest documents with their stored (dequantized) vectors, so callers needn't re-embed them"""
+        rows, _ = self._top_rows(embedding, k)
+        return [(self._document(i), self._vectors[i].astype(np.float32) * self._scales[i]) for i in rows]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    def get(self, include=None):
+        """Chroma-style dump of all stored chunks (used to rebuild the BM25 index)"""
+        records = [self._record(i) for i in range(len(self))]
+        return {
+            "documents": [record["text"] for record in records],
+            "metadatas": [record["metadata"] for record in records]
+        }
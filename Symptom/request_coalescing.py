@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+
+# ------------------ Fingerprints ------------------
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivially different queries share a key"""
+    return " ".join(str(text or "").lower().split())
+
+def file_digest(filepath):
+    """Hash an uploaded file's contents (uploads get unique names, so the name is useless as a key)"""
+    if not filepath or not os.path.exists(filepath):
+        return ""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def fingerprint(*parts):
+    """Build a stable key from the normalized parts of a piece of work"""
+    normalized = [normalize_text(p) if isinstance(p, str) else p for p in parts]
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# ------------------ Single-flight ------------------
+class SingleFlight:
+    """Run identical concurrent work once; every other caller waits on the same future.
+
+    With ttl > 0 the completed result is also kept for that many seconds, so a
+    retry arriving after the leader finished reuses it instead of recomputing.
+    Failures are never kept.
+    """
+
+    def __init__(self, name, ttl=0):
+        self.name = name
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [future, finished_at]
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [
+            key for key, (_, finished_at) in self._calls.items()
+            if finished_at is not None and now - finished_at > self.ttl
+        ]
+        for key in expired:
+            del self._calls[key]
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), sharing the result with concurrent callers of the same key"""
+        with self._lock:
+            self._evict_expired()
+            entry = self._calls.get(key)
+            leader = entry is None
+            if leader:
+                future = Future()
+                self._calls[key] = [future, None]
+            else:
+                future = entry[0]
+
+        if not leader:
+            print(f"[{self.name}] Joined in-flight work for {key[:12]}")
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._calls.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self.ttl > 0 and key in self._calls:
+                self._calls[key][1] = time.monotonic()
+            else:
+                self._calls.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def in_flight(self):
+        """Number of keys currently being computed"""
+        with self._lock:
+            return sum(1 for _, finished_at in self._calls.values() if finished_at is None)
+
+    def __len__(self):
+        """Keys held, including completed results kept for ttl"""
+        with self._lock:
+            return len(self._calls)
+
+# ------------------ Shared flights ------------------
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+
+graph_flight = SingleFlight("graph")
+idempotency_flight = SingleFlight("idempotency", ttl=IDEMPOTENCY_TTL)
+llm_flight = SingleFlight("llm")
+search_flight = SingleFlight("serper-search")
+scrape_flight = SingleFlight("serper-scrape")
+tts_flight = SingleFlight("tts")
@@ -0,0 +1,261 @@
+"""Admission control in front of the consultation graph.
+
+Every /process request is triaged by a cheap local urgency detector and queued
+by priority. A reserve of workers only ever runs urgent consultations, so a
+user describing chest pain never waits behind multi-second preventive scrape
+pipelines. Non-urgent work is rate limited per client and shed under overload;
+shed requests get a precomputed answer bank entry or a templated reply.
+"""
+import os
+import re
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# ------------------ Configuration ------------------
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+SCHEDULER_URGENT_RESERVE = int(os.getenv("SCHEDULER_URGENT_RESERVE", "1"))  # workers only urgent work may use
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "32"))            # queued non-urgent requests
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "20"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+
+URGENT, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {URGENT: "urgent", NORMAL: "normal", LOW: "low"}
+
+# ------------------ Urgency detection ------------------
+# Red-flag presentations that should reach a worker immediately. Deliberately
+# broad: a false positive costs one reserved slot, a false negative costs minutes.
+# Apostrophes match both ' and the ’ that mobile keyboards insert.
+URGENT_PATTERNS = [re.compile(p) for p in (
+    r"\bchest (pain|pressure|tightness)\b",
+    r"\b(can['’]?t|cannot|trouble|difficulty|hard to) breath",
+    r"\bshort(ness)? of breath\b",
+    r"\b(face|arm|leg)s? (is |are )?(drooping|numb|weak)",
+    r"\bslurred speech\b",
+    r"\bstroke\b",
+    r"\bheart attack\b",
+    r"\b(unconscious|unresponsive|passed out|fainted|collapsed)\b",
+    r"\bseizure|convulsion",
+    r"\b(severe|heavy|won['’]?t stop) bleeding\b|\bbleeding (heavily|badly|won['’]?t stop)\b",
+    r"\b(vomiting|coughing( up)?) blood\b",
+    r"\banaphyla|\bthroat (is )?(swelling|closing)\b",
+    r"\b(suicid|kill myself|end my life|overdose)",
+    r"\bworst headache\b",
+    r"\bpoison(ed|ing)?\b"
+)]
+
+# Requests that only need general information and can wait the longest
+LOW_PRIORITY_PATTERNS = [re.compile(p) for p in (
+    r"\bprevent", r"\bavoid\b", r"\btips?\b", r"\breduce (the )?risk\b", r"\bprotect (myself|against)\b"
+)]
+
+
+def detect_urgency(text):
+    """Classify text as URGENT, NORMAL or LOW priority with regexes only (no model, no I/O)"""
+    text = (text or "").lower()
+    if any(pattern.search(text) for pattern in URGENT_PATTERNS):
+        return URGENT
+    if any(pattern.search(text) for pattern in LOW_PRIORITY_PATTERNS):
+        return LOW
+    return NORMAL
+
+
+# ------------------ Per-client rate limits ------------------
+class RateLimiter:
+    """Token bucket per client id; per worker process, so the effective limit scales with WEB_WORKERS"""
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, max_clients=10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = {}  # client -> [tokens, last refill]
+
+    def allow(self, client):
+        """Return (allowed, retry_after_seconds)"""
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = [tokens, now]
+                return False, (1 - tokens) / self.rate
+            self._buckets[client] = [tokens - 1, now]
+            if len(self._buckets) > self.max_clients:
+                # Forget full buckets; they'd be recreated full anyway
+                for key in [k for k, (t, _) in self._buckets.items() if t >= self.burst - 1]:
+                    del self._buckets[key]
+        return True, 0
+
+
+# ------------------ Priority scheduler ------------------
+class Overloaded(Exception):
+    """Raised by submit when a non-urgent request should be shed instead of queued"""
+
+
+class PriorityScheduler:
+    """Fixed worker threads pulling from one priority heap.
+
+    General workers take the most urgent queued task of any priority; reserved
+    workers only take urgent ones, so urgent work always has a free slot even
+    when every general worker is busy with slow pipelines.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, urgent_reserve=SCHEDULER_URGENT_RESERVE,
+                 max_queue=SCHEDULER_MAX_QUEUE, max_wait=SCHEDULER_MAX_WAIT_SECONDS):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.general_workers = max(1, workers - urgent_reserve)
+        self.reserve_workers = max(0, urgent_reserve)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._running = {priority: 0 for priority in PRIORITY_NAMES}
+        self._waits = {priority: deque(maxlen=256) for priority in PRIORITY_NAMES}
+        self._service_times = deque(maxlen=256)
+        self.counters = {"completed": 0, "shed": 0, "rate_limited": 0}
+
+        for i in range(self.general_workers):
+            threading.Thread(target=self._work, args=(False,), name=f"scheduler-{i}", daemon=True).start()
+        for i in range(self.reserve_workers):
+            threading.Thread(target=self._work, args=(True,), name=f"scheduler-urgent-{i}", daemon=True).start()
+
+    def _queued(self, priority=None):
+        return sum(1 for entry in self._heap if priority is None or entry[0] == priority)
+
+    def _estimated_wait(self, priority):
+        """Seconds until a new task at priority would start, from recent service times"""
+        if not self._service_times:
+            return 0.0
+        ahead = sum(1 for entry in self._heap if entry[0] <= priority)
+        average = sum(self._service_times) / len(self._service_times)
+        return ahead * average / self.general_workers
+
+    def submit(self, priority, fn, *args, **kwargs):
+        """Queue fn at priority and return a Future; raises Overloaded for sheddable work"""
+        future = Future()
+        with self._cond:
+            if priority != URGENT:
+                queued = sum(1 for entry in self._heap if entry[0] != URGENT)
+                if queued >= self.max_queue or self._estimated_wait(priority) > self.max_wait:
+                    self.counters["shed"] += 1
+                    raise Overloaded()
+            heapq.heappush(self._heap, (priority, next(self._sequence), time.monotonic(), future, fn, args, kwargs))
+            self._cond.notify_all()
+        return future
+
+    def _work(self, urgent_only):
+        while True:
+            with self._cond:
+                while not self._heap or (urgent_only and self._heap[0][0] != URGENT):
+                    self._cond.wait()
+                priority, _, enqueued, future, fn, args, kwargs = heapq.heappop(self._heap)
+                self._running[priority] += 1
+                self._waits[priority].append(time.monotonic() - enqueued)
+
+            started = time.monotonic()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._cond:
+                self._running[priority] -= 1
+                self._service_times.append(time.monotonic() - started)
+                self.counters["completed"] += 1
+
+    def count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    def metrics(self):
+        """Queue depth, running tasks and wait-time percentiles per priority"""
+        def percentile(values, q):
+            return round(values[min(len(values) - 1, int(q * len(values)))], 3) if values else 0.0
+
+        with self._cond:
+            queues = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[priority])
+                queues[name] = {
+                    "queued": self._queued(priority),
+                    "running": self._running[priority],
+                    "wait_p50_seconds": percentile(waits, 0.5),
+                    "wait_p95_seconds": percentile(waits, 0.95),
+                    "estimated_wait_seconds": round(self._estimated_wait(priority), 3)
+                }
+            return {
+                "workers": {"general": self.general_workers, "urgent_reserve": self.reserve_workers},
+                "queues": queues,
+                **self.counters
+            }
+
+
+# ------------------ Load shedding ------------------
+SHED_TEMPLATES = {
+    LOW: (
+        "We're handling a very high number of requests right now, so a full answer isn't available. "
+        "Please try again in a few minutes. General prevention advice: wash your hands regularly, stay up to "
+        "date with vaccinations, eat a balanced diet, stay active and get enough sleep."
+    ),
+    NORMAL: (
+        "We're handling a very high number of requests right now and couldn't review your symptoms in time. "
+        "Please try again in a few minutes. If your symptoms are severe or getting worse, contact a doctor "
+        "or your local emergency number."
+    )
+}
+
+
+def shed_response(priority, query):
+    """Best degraded answer for a shed request: a vetted answer bank entry if one matches, else a template"""
+    from answer_bank import answer_bank
+
+    kinds = ("preventive", "symptom") if priority == LOW else ("symptom", "preventive")
+    for kind in kinds:
+        try:
+            entry, _ = answer_bank.lookup(kind, query)
+        except Exception as e:
+            print(f"Answer bank lookup failed while shedding: {e}")
+            break
+        if entry:
+            return {"doctor_response": entry["answer"], "voice_of_doctor": entry["audio_path"], "shed": "cached"}
+    return {"doctor_response": SHED_TEMPLATES[priority], "voice_of_doctor": "", "shed": "templated"}
+
+
+# Threads are started lazily so nothing is inherited across a gunicorn fork
+_scheduler = None
+_rate_limiter = None
+_init_lock = threading.Lock()
+
+
+def limit_queue(max_queue):
+    """Lower the non-urgent queue bound before the scheduler starts, so every admitted
+    request fits the web threads and the excess is shed at admission instead"""
+    global SCHEDULER_MAX_QUEUE
+    max_queue = max(0, max_queue)
+    if max_queue < SCHEDULER_MAX_QUEUE:
+        print(f"[scheduler] Capping the queue at {max_queue} (SCHEDULER_MAX_QUEUE={SCHEDULER_MAX_QUEUE})")
+        SCHEDULER_MAX_QUEUE = max_queue
+
+
+def get_scheduler():
+    global _scheduler
+    with _init_lock:
+        if _scheduler is None:
+            _scheduler = PriorityScheduler(max_queue=SCHEDULER_MAX_QUEUE)
+    return _scheduler
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    with _init_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+    return _rate_limiter
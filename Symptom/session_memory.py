@@ -0,0 +1,192 @@
+import os
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from context_builder import estimate_tokens
+
+# ------------------ Configuration ------------------
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.sqlite3")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_KEEP_TURNS = int(os.getenv("SESSION_KEEP_TURNS", "4"))          # turns kept verbatim
+SESSION_CONTEXT_TOKENS = int(os.getenv("SESSION_CONTEXT_TOKENS", "800"))  # budget for summary + turns
+SESSION_MAX_STORED_TURNS = SESSION_KEEP_TURNS * 4                        # older turns live in the summary
+EVICTION_INTERVAL_SECONDS = 300
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# Summaries and TTL bookkeeping live beside the checkpoints in the same SQLite file,
+# on their own connection so they never contend with the checkpointer's lock
+_conn = None
+_conn_lock = threading.Lock()
+_checkpointer = None
+_summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-summary")
+_last_eviction = 0.0
+
+
+def _open(path):
+    # WAL lets readers run alongside the other connection's writes, and the busy
+    # timeout makes a writer wait for the lock instead of failing "database is locked"
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        _conn = _open(SESSION_DB_PATH)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_summaries ("
+            "thread_id TEXT PRIMARY KEY, summary TEXT NOT NULL DEFAULT '', "
+            "summarized_upto INTEGER NOT NULL DEFAULT 0, last_seen REAL NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def get_checkpointer():
+    """Shared LangGraph checkpointer backed by the local session database"""
+    global _checkpointer
+    if _checkpointer is None:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        _checkpointer = SqliteSaver(_open(SESSION_DB_PATH))
+    return _checkpointer
+
+
+def append_turns(existing, new):
+    """State reducer: append new turns and keep only the most recent stored window"""
+    return ((existing or []) + (new or []))[-SESSION_MAX_STORED_TURNS:]
+
+
+def _format_turn(turn):
+    return f"User: {turn['user']}\nAssistant: {turn['assistant']}"
+
+
+def _load_summary(thread_id):
+    with _conn_lock:
+        row = _connection().execute(
+            "SELECT summary, summarized_upto FROM session_summaries WHERE thread_id = ?",
+            (thread_id,)
+        ).fetchone()
+    return row if row else ("", 0)
+
+
+def build_context(thread_id, history):
+    """Assemble summary plus the most recent turns verbatim within SESSION_CONTEXT_TOKENS"""
+    if not thread_id:
+        return ""
+    # Reads also drive eviction, so idle sessions expire without waiting for a write
+    _maybe_evict(time.time())
+    if not history:
+        return ""
+
+    summary, _ = _load_summary(thread_id)
+    budget = SESSION_CONTEXT_TOKENS - estimate_tokens(summary)
+
+    recent = []
+    for turn in reversed(history[-SESSION_KEEP_TURNS:]):
+        text = _format_turn(turn)
+        cost = estimate_tokens(text)
+        if cost > budget:
+            break
+        recent.insert(0, text)
+        budget -= cost
+
+    parts = []
+    if summary:
+        parts.append(f"Summary of earlier conversation: {summary}")
+    if recent:
+        parts.append("Recent conversation:\n" + "\n".join(recent))
+    return "\n\n".join(parts)
+
+
+def _summarize(thread_id, turns_to_fold, upto):
+    from langchain_groq import ChatGroq
+
+    # record_turn may have read summarized_upto before the previous job committed,
+    # so drop any turns that job already folded in
+    summary, summarized_upto = _load_summary(thread_id)
+    turns_to_fold = [turn for turn in turns_to_fold if turn["index"] >= summarized_upto]
+    if upto <= summarized_upto or not turns_to_fold:
+        return
+
+    llm = ChatGroq(
+        groq_api_key=os.environ.get("GROQ_API_KEY"),
+        model_name="llama-3.1-8b-instant",
+        temperature=0
+    )
+    transcript = "\n".join(_format_turn(turn) for turn in turns_to_fold)
+    prompt = (
+        "Update the running summary of a patient's conversation with a medical assistant. "
+        "Keep symptoms, conditions, medications and advice given. At most 120 words.\n\n"
+        f"Current summary: {summary or 'none'}\n\nNew turns:\n{transcript}\n\nUpdated summary:"
+    )
+    new_summary = llm.invoke(prompt).content.strip()
+
+    with _conn_lock:
+        conn = _connection()
+        conn.execute(
+            "UPDATE session_summaries SET summary = ?, summarized_upto = ? WHERE thread_id = ?",
+            (new_summary, upto, thread_id)
+        )
+        conn.commit()
+
+
+def _summarize_safely(thread_id, turns_to_fold, upto):
+    try:
+        _summarize(thread_id, turns_to_fold, upto)
+    except Exception as e:
+        print(f"Session summary failed for {thread_id}: {e}")
+
+
+def record_turn(thread_id, history):
+    """Mark the session as active and fold turns older than the verbatim window into
+    the rolling summary in the background, off the request's critical path.
+
+    history is the stored window after the new turn was appended; each turn carries
+    an absolute "index" so the summary knows which turns it already covers.
+    """
+    now = time.time()
+    with _conn_lock:
+        conn = _connection()
+        conn.execute(
+            "INSERT INTO session_summaries (thread_id, last_seen) VALUES (?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen",
+            (thread_id, now)
+        )
+        conn.commit()
+
+    _, summarized_upto = _load_summary(thread_id)
+    older = [turn for turn in history[:-SESSION_KEEP_TURNS] if turn["index"] >= summarized_upto]
+    if older:
+        _summarizer.submit(_summarize_safely, thread_id, older, older[-1]["index"] + 1)
+
+    _maybe_evict(now)
+
+
+def _maybe_evict(now):
+    global _last_eviction
+    if now - _last_eviction < EVICTION_INTERVAL_SECONDS:
+        return
+    _last_eviction = now
+    _summarizer.submit(evict_expired_sessions)
+
+
+def evict_expired_sessions():
+    """Delete checkpoints and summaries of sessions idle longer than SESSION_TTL_SECONDS"""
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    with _conn_lock:
+        conn = _connection()
+        expired = [row[0] for row in conn.execute(
+            "SELECT thread_id FROM session_summaries WHERE last_seen < ?", (cutoff,)
+        )]
+    checkpointer = get_checkpointer()
+    for thread_id in expired:
+        checkpointer.delete_thread(thread_id)
+        with _conn_lock:
+            conn.execute("DELETE FROM session_summaries WHERE thread_id = ?", (thread_id,))
+            conn.commit()
+    if expired:
+        print(f"[sessions] Evicted {len(expired)} expired sessions")
+    return len(expired)
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# ------------------ Shared cache tier ------------------
+# One SQLite file in WAL mode shared by every worker process. Each process (and
+# thread) opens its own connection lazily, so nothing is inherited across fork.
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "shared_cache.sqlite3")
+
+NAMESPACE_TTLS = {
+    "answers": int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "600")),
+    "transcripts": int(os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    "tts": int(os.getenv("TTS_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    "geo": int(os.getenv("GEO_CACHE_TTL_SECONDS", str(24 * 3600)))
+}
+PURGE_INTERVAL_SECONDS = 300
+
+_local = threading.local()
+_last_purge = 0.0
+
+
+def _connection():
+    if getattr(_local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(SHARED_CACHE_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        conn.commit()
+        _local.conn, _local.pid = conn, os.getpid()
+    return _local.conn
+
+
+def cache_get(namespace, key):
+    """Return the cached JSON value, or None when missing or expired"""
+    try:
+        row = _connection().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Shared cache read failed: {e}")
+        return None
+    if not row or row[1] < time.time():
+        return None
+    return json.loads(row[0])
+
+
+def cache_set(namespace, key, value, ttl=None):
+    ttl = NAMESPACE_TTLS.get(namespace, 3600) if ttl is None else ttl
+    try:
+        conn = _connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl)
+        )
+        conn.commit()
+        _maybe_purge()
+    except sqlite3.Error as e:
+        print(f"Shared cache write failed: {e}")
+
+
+def _maybe_purge():
+    # Writes sweep expired rows at most every PURGE_INTERVAL_SECONDS per process
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    purge_expired()
+
+
+def cached(namespace, key, compute, ttl=None):
+    """Return the shared cached value for key, computing and storing it on a miss"""
+    value = cache_get(namespace, key)
+    if value is None:
+        value = compute()
+        if value is not None:
+            cache_set(namespace, key, value, ttl)
+    return value
+
+
+def purge_expired():
+    """Drop expired rows; returns how many were removed"""
+    conn = _connection()
+    removed = conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),)).rowcount
+    conn.commit()
+    return removed
+
+
+def cache_stats():
+    """Row count and stored bytes per namespace"""
+    rows = _connection().execute(
+        "SELECT namespace, COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache GROUP BY namespace"
+    ).fetchall()
+    return {namespace: {"entries": count, "bytes": size} for namespace, count, size in rows}
@@ -0,0 +1,194 @@
+"""Speculative execution of route-specific work alongside the classifier.
+
+As soon as the query text is known, the route node starts each branch's
+retrieval (symptom hybrid retrieval, preventive index lookup) in the background
+while the classifier LLM call runs. The selected agent claims its prefetched
+result instead of retrieving again; unselected branches are cancelled if they
+haven't started, and otherwise their results are dropped when they finish.
+
+Speculations are keyed by branch, query and the id of the request that started
+them, so concurrent requests with the same text never claim or cancel each
+other's work.
+
+SPECULATION_POLICY caps the wasted work:
+    off       never speculate
+    always    speculate every branch on every request
+    adaptive  (default) pause a branch while its recent wasted seconds exceed
+              SPECULATION_MAX_WASTE_RATIO of its speculative seconds, probing
+              every SPECULATION_PROBE_EVERY requests so it can recover
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from request_coalescing import fingerprint
+
+# ------------------ Configuration ------------------
+SPECULATION_POLICY = os.getenv("SPECULATION_POLICY", "adaptive")
+SPECULATION_MAX_WASTE_RATIO = float(os.getenv("SPECULATION_MAX_WASTE_RATIO", "0.5"))
+SPECULATION_MAX_INFLIGHT = int(os.getenv("SPECULATION_MAX_INFLIGHT", "8"))
+SPECULATION_PROBE_EVERY = 10
+SPECULATION_TTL_SECONDS = 60  # unclaimed results older than this are dropped as waste
+WINDOW = 100
+
+_lock = threading.RLock()  # _drop may run a done-callback synchronously while held
+_executor = None
+_pending = {}   # (branch, request id, query) key -> {"branch", "future", "started"}
+_inflight = 0
+_stats = {}     # branch -> counters and rolling window
+
+
+def _branch_stats(branch):
+    if branch not in _stats:
+        _stats[branch] = {
+            "launched": 0, "used": 0, "discarded": 0, "skipped": 0,
+            "saved_seconds": 0.0, "wasted_seconds": 0.0,
+            "window": deque(maxlen=WINDOW)  # (used, seconds of speculative work)
+        }
+    return _stats[branch]
+
+
+def _get_executor():
+    # Created lazily so no threads are inherited across a gunicorn fork
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SPECULATION_MAX_INFLIGHT, thread_name_prefix="speculate")
+    return _executor
+
+
+def _allowed(branch):
+    if SPECULATION_POLICY == "off" or _inflight >= SPECULATION_MAX_INFLIGHT:
+        return False
+    if SPECULATION_POLICY == "always":
+        return True
+    stats = _branch_stats(branch)
+    spent = sum(seconds for _, seconds in stats["window"])
+    wasted = sum(seconds for used, seconds in stats["window"] if not used)
+    if spent and wasted / spent > SPECULATION_MAX_WASTE_RATIO:
+        return (stats["launched"] + stats["skipped"]) % SPECULATION_PROBE_EVERY == 0
+    return True
+
+
+def _record(branch, used, seconds, saved=0.0):
+    stats = _branch_stats(branch)
+    stats["window"].append((used, seconds))
+    if used:
+        stats["used"] += 1
+        stats["saved_seconds"] += saved
+    else:
+        stats["discarded"] += 1
+        stats["wasted_seconds"] += seconds
+
+
+def _expire(now):
+    for key in [k for k, entry in _pending.items() if now - entry["started"] > SPECULATION_TTL_SECONDS]:
+        _drop(_pending.pop(key))
+
+
+def _drop(entry):
+    """Cancel an unclaimed speculation, or account its work as wasted once it finishes"""
+    global _inflight
+    if entry["future"].cancel():
+        # Never started, so run() won't release its in-flight slot
+        _inflight -= 1
+        _record(entry["branch"], False, 0.0)
+        return
+
+    def finished(future):
+        with _lock:
+            _record(entry["branch"], False, entry.get("duration", time.monotonic() - entry["started"]))
+
+    entry["future"].add_done_callback(finished)
+
+
+def speculate(branches, query, request_id):
+    """Start each {branch: fn(query)} for request_id in the background, subject to the policy"""
+    global _inflight
+    if not query or not request_id:
+        return
+    now = time.monotonic()
+    with _lock:
+        _expire(now)
+        for branch, fn in branches.items():
+            key = fingerprint(branch, request_id, query)
+            if key in _pending:
+                continue
+            if not _allowed(branch):
+                _branch_stats(branch)["skipped"] += 1
+                continue
+            entry = {"branch": branch, "started": now}
+
+            def run(fn=fn, entry=entry):
+                global _inflight
+                try:
+                    return fn(query)
+                finally:
+                    entry["duration"] = time.monotonic() - entry["started"]
+                    with _lock:
+                        _inflight -= 1
+
+            _inflight += 1
+            entry["future"] = _get_executor().submit(run)
+            _pending[key] = entry
+            _branch_stats(branch)["launched"] += 1
+
+
+def claim(branch, query, request_id):
+    """Return (True, result) if request_id's speculation for query finished or is running, else (False, None).
+
+    Waits for a running speculation rather than starting the same work twice.
+    A failed speculation is reported as missing so the caller runs it normally.
+    """
+    if not request_id:
+        return False, None
+    with _lock:
+        entry = _pending.pop(fingerprint(branch, request_id, query), None)
+    if entry is None:
+        return False, None
+
+    waited_from = time.monotonic()
+    try:
+        result = entry["future"].result()
+    except Exception as e:
+        print(f"[speculation] {branch} failed, running it inline: {e}")
+        with _lock:
+            _record(branch, False, time.monotonic() - entry["started"])
+        return False, None
+    waited = time.monotonic() - waited_from
+
+    # Latency saved is the part of the branch that overlapped the classifier
+    with _lock:
+        _record(branch, True, entry["duration"], saved=max(0.0, entry["duration"] - waited))
+    return True, result
+
+
+def discard(query, request_id, keep=None):
+    """Drop every pending speculation request_id started for query except the branch named keep"""
+    if not request_id:
+        return
+    with _lock:
+        for branch in list(_stats):
+            if branch == keep:
+                continue
+            entry = _pending.pop(fingerprint(branch, request_id, query), None)
+            if entry is not None:
+                _drop(entry)
+
+
+def speculation_stats():
+    """Per-route launched/used/discarded counts, wasted and saved seconds"""
+    with _lock:
+        report = {}
+        for branch, stats in _stats.items():
+            counters = {k: v for k, v in stats.items() if k != "window"}
+            counters["saved_seconds"] = round(counters["saved_seconds"], 3)
+            counters["wasted_seconds"] = round(counters["wasted_seconds"], 3)
+            counters["avg_saved_seconds"] = round(stats["saved_seconds"] / stats["used"], 3) if stats["used"] else 0.0
+            report[branch] = counters
+        return {
+            "policy": SPECULATION_POLICY,
+            "inflight": _inflight,
+            "pending": len(_pending),
+            "routes": report
+        }
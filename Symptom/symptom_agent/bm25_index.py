@@ -0,0 +1,115 @@
+import os
+import re
+import gzip
+import json
+import math
+from collections import Counter, defaultdict
+from langchain.schema import Document
+
+# ------------------ Configuration ------------------
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./chroma_db/bm25_index.json.gz")
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60                   # standard reciprocal rank fusion constant
+LEXICAL_FAST_PATH_TERMS = 3  # keyword queries this short skip the dense index
+
+_token_pattern = re.compile(r"[a-z0-9]+")
+_stopwords = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "in", "on", "for", "and",
+    "or", "what", "how", "i", "my", "me", "do", "does", "can", "it", "with", "have", "has"
+}
+
+
+def tokenize(text):
+    return [token for token in _token_pattern.findall((text or "").lower()) if token not in _stopwords]
+
+
+class BM25Index:
+    """Precomputed sparse inverted index over the RAG chunks"""
+
+    def __init__(self, texts=(), metadatas=None):
+        self.texts = []
+        self.metadatas = []
+        self.doc_lengths = []
+        self.postings = {}  # term -> [(doc_id, term_frequency)]
+        texts = list(texts)
+        for text, metadata in zip(texts, metadatas or [{} for _ in texts]):
+            self.add(text, metadata)
+        self._prepare()
+
+    def add(self, text, metadata=None):
+        """Index one more chunk; call _prepare (or save) once adding is done"""
+        doc_id = len(self.texts)
+        self.texts.append(text)
+        self.metadatas.append(metadata or {})
+        counts = Counter(tokenize(text))
+        self.doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, []).append((doc_id, tf))
+
+    def _prepare(self):
+        n = len(self.texts)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, k=10):
+        """Return [(doc_id, score)] for the k best matching chunks"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def search_documents(self, query, k=10):
+        return [
+            Document(page_content=self.texts[doc_id], metadata=self.metadatas[doc_id])
+            for doc_id, _ in self.search(query, k)
+        ]
+
+    def is_keyword_query(self, query):
+        """Short queries made only of indexed terms are served lexically without an embedding"""
+        terms = tokenize(query)
+        return 0 < len(terms) <= LEXICAL_FAST_PATH_TERMS and all(term in self.idf for term in terms)
+
+    def save(self, path=BM25_INDEX_PATH):
+        self._prepare()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings
+        }
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f)
+
+    @classmethod
+    def load(cls, path=BM25_INDEX_PATH):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        index = cls.__new__(cls)
+        index.texts = payload["texts"]
+        index.metadatas = payload["metadatas"]
+        index.doc_lengths = payload["doc_lengths"]
+        index.postings = {term: [tuple(p) for p in docs] for term, docs in payload["postings"].items()}
+        index._prepare()
+        return index
+
+
+def reciprocal_rank_fusion(result_lists, k=10):
+    """Fuse ranked Document lists by reciprocal rank, identifying chunks by their text"""
+    scores = defaultdict(float)
+    documents = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            scores[doc.page_content] += 1.0 / (RRF_K + rank + 1)
+            documents.setdefault(doc.page_content, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[text] for text in ranked]
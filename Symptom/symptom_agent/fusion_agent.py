@@ -0,0 +1,143 @@
+from langgraph.graph import StateGraph, END
+from typing import TypedDict, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from langchain_groq import ChatGroq
+from request_coalescing import fingerprint, llm_flight
+from voice_of_the_doctor import text_to_speech_with_elevenlabs
+from .image_voice_agent import analyze_image
+from .rag_agent import query_rag_system
+import os
+import time
+
+# Photo + description consultations run vision and RAG side by side and merge them
+FUSION_ENABLED = os.getenv("FUSION_ENABLED", "1") == "1"
+# After this many seconds, whichever branch has finished is returned on its own
+FUSION_DEADLINE_SECONDS = float(os.getenv("FUSION_DEADLINE_SECONDS", "12"))
+# If neither has finished by then, wait at most this much longer for the first one
+FUSION_GRACE_SECONDS = float(os.getenv("FUSION_GRACE_SECONDS", "8"))
+FUSION_WORKERS = int(os.getenv("FUSION_WORKERS", "8"))  # two per concurrent fused consultation
+
+class FusionState(TypedDict):
+    audio_filepath: Optional[str]
+    image_filepath: Optional[str]
+    query_text: Optional[str]
+    speech_to_text: Optional[str]
+    doctor_response: Optional[str]
+    voice_of_doctor: Optional[str]
+    conversation_context: Optional[str]
+    branch_timings: Optional[dict]
+    context_stats: Optional[dict]
+    speculation_id: Optional[str]
+
+SYNTHESIS_PROMPT = """You are a doctor speaking to a patient. Combine the two assessments below into one answer.
+The first comes from looking at the patient's photo, the second from medical reference material about what they described.
+Lead with what the photo shows, use the reference material to explain likely causes and next steps, and drop anything that contradicts the photo.
+Do not use markdown, lists or numbers. Keep it to at most four sentences and always recommend seeing a real doctor for serious concerns.
+
+Patient's description: {question}
+
+Assessment from the photo: {vision}
+
+Assessment from reference material: {rag}
+
+Answer:"""
+
+# Created lazily so no threads are inherited across a gunicorn fork
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=FUSION_WORKERS, thread_name_prefix="fusion")
+    return _executor
+
+def _timed(fn, state):
+    start = time.perf_counter()
+    result = fn(state)
+    return result, time.perf_counter() - start
+
+def synthesize(question, vision_response, rag_response):
+    """Merge the vision and RAG answers into one response with a single LLM call"""
+    llm = ChatGroq(
+        groq_api_key=os.environ.get("GROQ_API_KEY"),
+        model_name="llama-3.1-8b-instant"
+    )
+    prompt = SYNTHESIS_PROMPT.format(question=question, vision=vision_response, rag=rag_response)
+    return llm_flight.do(fingerprint("fusion", prompt), llm.invoke, prompt).content.strip()
+
+def fuse_analysis(state: FusionState):
+    """Run vision and RAG concurrently, then synthesize, falling back to one branch at the deadline"""
+    started = time.perf_counter()
+    executor = _get_executor()
+    futures = {
+        executor.submit(_timed, analyze_image, state): "vision",
+        executor.submit(_timed, query_rag_system, state): "rag"
+    }
+    done, _ = wait(futures, timeout=FUSION_DEADLINE_SECONDS)
+    if not done:
+        # Nothing finished in time: take whichever branch finishes first within the grace period
+        done, _ = wait(futures, timeout=FUSION_GRACE_SECONDS, return_when=FIRST_COMPLETED)
+    # A late branch keeps running in the background; its result is simply dropped
+
+    responses, timings, context_stats = {}, {}, None
+    for future in done:
+        branch = futures[future]
+        try:
+            result, timings[branch] = future.result()
+            responses[branch] = result["doctor_response"]
+            context_stats = result.get("context_stats") or context_stats
+        except Exception as e:
+            print(f"[fusion] {branch} branch failed: {e}")
+    for branch in futures.values():
+        timings.setdefault(branch, None)  # None: timed out or failed
+
+    if len(responses) == 2:
+        synthesis_start = time.perf_counter()
+        try:
+            doctor_response = synthesize(
+                state.get("speech_to_text") or state.get("query_text", ""), responses["vision"], responses["rag"]
+            )
+            mode = "fused"
+        except Exception as e:
+            print(f"[fusion] Synthesis failed, returning both answers: {e}")
+            doctor_response = f"{responses['vision']} {responses['rag']}"
+            mode = "concatenated"
+        timings["synthesis"] = time.perf_counter() - synthesis_start
+    elif responses:
+        mode, doctor_response = next((f"{branch}_only", response) for branch, response in responses.items())
+    else:
+        mode = "failed" if done else "timed_out"
+        doctor_response = "I'm having trouble analyzing your photo and symptoms right now."
+
+    timings = {branch: round(seconds, 3) if seconds is not None else None for branch, seconds in timings.items()}
+    timings["total"] = round(time.perf_counter() - started, 3)
+    timings["mode"] = mode
+    print(f"[fusion] {timings}")
+    return {"doctor_response": doctor_response, "branch_timings": timings, "context_stats": context_stats}
+
+def generate_voice_response(state: FusionState):
+    """Convert the doctor's response to speech"""
+    if state.get("doctor_response"):
+        voice_of_doctor = text_to_speech_with_elevenlabs(
+            input_text=state["doctor_response"],
+            output_filepath="final.mp3"
+        )
+        return {"voice_of_doctor": voice_of_doctor}
+    return {"voice_of_doctor": None}
+
+def create_fusion_agent():
+    """Create the fused image + text workflow"""
+    workflow = StateGraph(FusionState)
+
+    # Add nodes
+    workflow.add_node("fuse", fuse_analysis)
+    workflow.add_node("generate_voice", generate_voice_response)
+
+    # Set entry point
+    workflow.set_entry_point("fuse")
+
+    # Add edges
+    workflow.add_edge("fuse", "generate_voice")
+    workflow.add_edge("generate_voice", END)
+
+    return workflow.compile()
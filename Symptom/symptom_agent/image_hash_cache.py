@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from request_coalescing import normalize_text
+
+# ------------------ Configuration ------------------
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "6"))  # differing bits out of 64
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(24 * 3600)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+
+HASH_SIZE = 8            # 8x8 = 64-bit hashes
+PHASH_IMAGE_SIZE = 32    # DCT input resolution
+
+
+# ------------------ Perceptual hashes ------------------
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def _grayscale(image_path, size):
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image).convert("L").resize(size, Image.LANCZOS)
+        return np.asarray(image, dtype=np.float32)
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(image_path):
+    """64-bit DCT perceptual hash; robust to re-compression, resizing and small crops"""
+    pixels = _grayscale(image_path, (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE))
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_int(low > np.median(low.flatten()[1:]))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# ------------------ BK-tree ------------------
+class BKTree:
+    """Metric tree over 64-bit hashes; lookups only visit subtrees that can be within range"""
+
+    def __init__(self):
+        self.root = None  # [hash, {distance: child}]
+        self.size = 0
+
+    def add(self, value):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return [(distance, hash)] for every stored hash within max_distance, nearest first"""
+        if self.root is None:
+            return []
+        matches, stack = [], [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, node_value))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches)
+
+
+# ------------------ Diagnosis cache ------------------
+class ImageDiagnosisCache:
+    """Reuse vision diagnoses for near-identical images asked with the same question.
+
+    Entries are keyed on the image hash and the normalized question only, so the
+    same photo and question from another session still hits. They expire after
+    IMAGE_CACHE_TTL_SECONDS (checked on lookup) and the least recently used are
+    evicted past IMAGE_CACHE_MAX_ENTRIES. BK-trees don't support deletion, so
+    removed hashes stay in the tree until it is rebuilt once they outnumber the
+    live entries.
+    """
+
+    def __init__(self, max_distance=IMAGE_CACHE_MAX_DISTANCE, ttl=IMAGE_CACHE_TTL_SECONDS,
+                 max_entries=IMAGE_CACHE_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._entries = OrderedDict()  # (hash, query) -> {"diagnosis", "created_at"}, least recently used first
+        self._removed = 0  # entries dropped since the tree was last rebuilt
+        self.hits = 0
+        self.misses = 0
+
+    def _live(self, entry, now):
+        return now - entry["created_at"] <= self.ttl
+
+    def lookup(self, image_hash, query):
+        """Return (diagnosis, distance) for the nearest live match, or (None, None)"""
+        query = normalize_text(query)
+        now = time.time()
+        with self._lock:
+            for distance, candidate in self._tree.search(image_hash, self.max_distance):
+                key = (candidate, query)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if not self._live(entry, now):
+                    self._remove(key)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["diagnosis"], distance
+            self.misses += 1
+        return None, None
+
+    def store(self, image_hash, query, diagnosis):
+        now = time.time()
+        with self._lock:
+            key = (image_hash, normalize_text(query))
+            self._tree.add(image_hash)
+            self._entries[key] = {"diagnosis": diagnosis, "created_at": now}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._removed += 1
+        if self._removed > max(len(self._entries), 1):
+            self._tree = BKTree()
+            for image_hash in {image_hash for image_hash, _ in self._entries}:
+                self._tree.add(image_hash)
+            self._removed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+image_cache = ImageDiagnosisCache()
@@ -2,6 +2,7 @@ from langgraph.graph import StateGraph, END
 from typing import TypedDict, Optional
 from brain_of_the_doctor import encode_image, analyze_image_with_query
 from voice_of_the_doctor import text_to_speech_with_elevenlabs
+from .image_hash_cache import image_cache, phash
 
 class ImageVoiceState(TypedDict):
     audio_filepath: Optional[str]
@@ -10,6 +11,7 @@ class ImageVoiceState(TypedDict):
     speech_to_text: Optional[str]
     doctor_response: Optional[str]
     voice_of_doctor: Optional[str]
+    conversation_context: Optional[str]
 
 system_prompt = """You have to act as a professional doctor, i know you are not but this is for learning purpose. 
 What's in this image?. Do you find anything wrong with it medically? 
@@ -22,12 +24,31 @@ Keep your answer concise (max 2 sentences). No preamble, start your answer right
 def analyze_image(state: ImageVoiceState):
     """Analyze the image and provide medical insights"""
     if state.get("image_filepath"):
-        query = system_prompt + (state.get("speech_to_text", "") or state.get("query_text", ""))
+        question = state.get("speech_to_text", "") or state.get("query_text", "")
+        query = system_prompt + question
+        if state.get("conversation_context"):
+            query += "\n\nEarlier in this consultation:\n" + state["conversation_context"]
+
+        # Re-uploads of the same photo (re-cropped or re-compressed) with the same question
+        # reuse the earlier diagnosis, whichever session asked it first
+        try:
+            image_hash = phash(state["image_filepath"])
+        except Exception as e:
+            print(f"Image hashing failed: {e}")
+            image_hash = None
+        if image_hash is not None:
+            cached_response, distance = image_cache.lookup(image_hash, question)
+            if cached_response:
+                print(f"[image cache] Reused diagnosis (hamming distance {distance})")
+                return {"doctor_response": cached_response}
+
         doctor_response = analyze_image_with_query(
             query=query, 
             encoded_image=encode_image(state["image_filepath"]), 
             model="meta-llama/llama-4-scout-17b-16e-instruct"
         )
+        if image_hash is not None:
+            image_cache.store(image_hash, question, doctor_response)
         return {"doctor_response": doctor_response}
     return {"doctor_response": "No image provided for analysis"}
 
@@ -0,0 +1,77 @@
+"""Parse and split tasks for the ingestion process pool.
+
+Spawned workers import this module and nothing else: it has no heavy imports at
+module level, and process_pool hides the parent's __main__ while a worker starts,
+so launching ingestion from ex.py doesn't make every child reload the Groq,
+Whisper and embedding models that ex.py imports.
+"""
+import sys
+import types
+import hashlib
+import threading
+from multiprocessing.context import SpawnContext, SpawnProcess
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+_main_lock = threading.Lock()
+
+
+def chunk_id(unit_id, index, text):
+    return hashlib.sha1(f"{unit_id}:{index}:{text}".encode("utf-8")).hexdigest()
+
+
+def split(unit_id, texts_with_metadata):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = []
+    for text, metadata in texts_with_metadata:
+        for piece in splitter.split_text(text):
+            chunks.append((chunk_id(unit_id, len(chunks), piece), piece, metadata))
+    return chunks
+
+
+def parse_pdf_range(path, start, stop):
+    """Process-pool task: extract and split pages [start, stop) of a PDF"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = [
+        (reader.pages[i].extract_text() or "", {"source": path, "page": i})
+        for i in range(start, min(stop, len(reader.pages)))
+    ]
+    return split(f"pdf:{path}:{start}-{stop}", pages), len(pages)
+
+
+def fetch_url(url, headers):
+    from langchain_community.document_loaders import WebBaseLoader
+
+    docs = WebBaseLoader(url, header_template=headers).load()
+    return split(f"url:{url}", [(doc.page_content, doc.metadata) for doc in docs]), len(docs)
+
+
+# ------------------ Process pool ------------------
+class _LightSpawnProcess(SpawnProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        # spawn re-imports the parent's __main__ in every child unless it has neither
+        # __spec__ nor __file__; present a bare module while the child is prepared
+        with _main_lock:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = types.ModuleType("__main__")
+            try:
+                return SpawnProcess._Popen(process_obj)
+            finally:
+                sys.modules["__main__"] = main
+
+
+class _LightSpawnContext(SpawnContext):
+    Process = _LightSpawnProcess
+
+
+def process_pool(max_workers):
+    """Spawn-context pool whose workers import only this module's dependencies"""
+    # spawn, not fork: the embedding thread (and torch's pools) are already running
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=_LightSpawnContext())
@@ -0,0 +1,308 @@
+"""Streaming, resumable ingestion of the symptom RAG corpus.
+
+    pages (process pool: parse + split)  ->  chunk queue  ->  embed (batched)  ->  write queue  ->  vector store
+
+PDF page ranges are parsed and split across a process pool and web pages are
+fetched concurrently. Chunks flow through bounded queues, so a slow embedder
+applies backpressure and memory stays flat however large the corpus is; the BM25
+postings are built from the same stream as chunks are written. Every chunk has a
+deterministic id and progress is checkpointed to a state file after each write,
+so an interrupted run can be resumed where it stopped.
+
+A web page that can't be fetched doesn't fail the run: it is recorded under
+"failed_units" in the state file and the baseline fallback documents are
+indexed instead.
+
+Run standalone from the Symptom directory (resumes an interrupted run):
+    python -m symptom_agent.ingestion [--fresh]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .ingest_workers import chunk_id, parse_pdf_range, fetch_url, process_pool
+
+# ------------------ Configuration ------------------
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) - 1))))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "512"))  # chunks buffered between stages
+PROGRESS_INTERVAL_SECONDS = 5
+
+# Indexed when a web page can't be fetched or nothing else was ingested
+FALLBACK_TEXTS = [
+    "Common symptoms include fever, cough, headache, and fatigue.",
+    "Always consult a healthcare professional for medical advice.",
+    "Seek immediate medical attention for severe symptoms like chest pain or difficulty breathing."
+]
+
+_DONE = object()
+
+
+# ------------------ Resume state ------------------
+class IngestionState:
+    """Completed units, chunk ids already written for the unit in progress and
+    web pages that couldn't be fetched (unit id -> error)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done_units, self.written, self.complete = set(), set(), False
+        self.failed_units = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                payload = json.load(f)
+            self.done_units = set(payload["done_units"])
+            self.written = set(payload["written"])
+            self.complete = payload.get("complete", False)
+            self.failed_units = payload.get("failed_units", {})
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "done_units": sorted(self.done_units),
+                "written": sorted(self.written),
+                "complete": self.complete,
+                "failed_units": self.failed_units
+            }, f)
+        os.replace(tmp, self.path)
+
+
+# ------------------ Pipeline ------------------
+class IngestionPipeline:
+    """Ingest into vectorstore, adding every newly written chunk to lexical_index
+    (a BM25Index) when one is given"""
+
+    def __init__(self, vectorstore, embeddings, state_path, lexical_index=None):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.lexical_index = lexical_index
+        self.state = IngestionState(state_path)
+        self.chunk_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.write_queue = queue.Queue(maxsize=max(2, INGEST_QUEUE_SIZE // INGEST_EMBED_BATCH))
+        self.pages = 0
+        self.chunks_queued = 0
+        self.chunks_written = 0
+        self.started = None
+        self._errors = []
+        self._stopped = threading.Event()  # set when a stage fails; the producer stops feeding
+        self._stored_ids = None  # chunk ids already in an mmap store, loaded when resuming
+
+    def _fail(self, stage, error):
+        print(f"[ingest] {stage} stage failed, stopping the pipeline: {error}")
+        self._errors.append(f"{stage}: {error}")
+        self._stopped.set()
+
+    # ---- stage 1: parse (runs in the calling thread, work in pools) ----
+    def _produce(self, pdf_paths, urls, headers):
+        tasks = []
+        for path in pdf_paths:
+            from pypdf import PdfReader
+
+            page_count = len(PdfReader(path).pages)
+            for start in range(0, page_count, INGEST_PAGES_PER_TASK):
+                unit_id = f"pdf:{path}:{start}-{start + INGEST_PAGES_PER_TASK}"
+                if unit_id not in self.state.done_units:
+                    tasks.append((unit_id, "pdf", (path, start, start + INGEST_PAGES_PER_TASK)))
+        for url in urls:
+            unit_id = f"url:{url}"
+            if unit_id not in self.state.done_units:
+                tasks.append((unit_id, "url", (url, headers)))
+
+        max_in_flight = 2 * INGEST_PROCESSES
+        with process_pool(INGEST_PROCESSES) as processes, ThreadPoolExecutor(max_workers=4) as threads:
+            pending = {}
+            for unit_id, kind, args in tasks:
+                # Bound the number of parsed-but-unqueued units so memory stays flat
+                while len(pending) >= max_in_flight:
+                    self._drain_one(pending)
+                if self._stopped.is_set():
+                    break
+                executor, fn = (processes, parse_pdf_range) if kind == "pdf" else (threads, fetch_url)
+                pending[executor.submit(fn, *args)] = unit_id
+            if self._stopped.is_set():
+                for future in pending:
+                    future.cancel()
+            while pending:
+                self._drain_one(pending)
+
+        needs_fallback = self.state.failed_units or not self._has_chunks()
+        if needs_fallback and "fallback" not in self.state.done_units and not self._stopped.is_set():
+            self._queue_fallback()
+
+    def _has_chunks(self):
+        if self.chunks_queued:
+            return True
+        if hasattr(self.vectorstore, "add_embeddings"):
+            return len(self.vectorstore) > 0
+        return self.vectorstore._collection.count() > 0
+
+    def _queue_fallback(self):
+        """Index the baseline documents as one more unit"""
+        for i, text in enumerate(FALLBACK_TEXTS):
+            chunk = (chunk_id("fallback", i, text), text, {"source": "fallback", "id": i})
+            if chunk[0] not in self.state.written:
+                self.chunk_queue.put(chunk)
+        self.chunk_queue.put(("unit_done", "fallback"))
+
+    def _drain_one(self, pending):
+        """Hand the next finished unit's chunks to the embedder"""
+        future = next(as_completed(pending))
+        unit_id = pending.pop(future)
+        try:
+            chunks, pages = future.result()
+        except Exception as e:
+            print(f"[ingest] Failed {unit_id}: {e}")
+            if unit_id.startswith("url:"):
+                # A page that is down or blocking us mustn't leave the index incomplete
+                self.state.failed_units[unit_id] = str(e)
+            else:
+                self._errors.append(unit_id)
+            return
+        if self._stopped.is_set():
+            return
+        self.state.failed_units.pop(unit_id, None)
+        self.pages += pages
+        for chunk in chunks:
+            if chunk[0] not in self.state.written:
+                self.chunk_queue.put(chunk)  # blocks when embedding falls behind
+                self.chunks_queued += 1
+        self.chunk_queue.put(("unit_done", unit_id))
+
+    # ---- stage 2: batched embedding ----
+    def _embed(self):
+        batch = []
+        item = None
+
+        def flush():
+            if batch:
+                vectors = self.embeddings.embed_documents([text for _, text, _ in batch])
+                self.write_queue.put((list(batch), vectors))
+                batch.clear()
+
+        try:
+            while True:
+                item = self.chunk_queue.get()
+                if item is _DONE:
+                    flush()
+                    break
+                if item[0] == "unit_done":
+                    flush()
+                    self.write_queue.put(item)
+                    continue
+                batch.append(item)
+                if len(batch) >= INGEST_EMBED_BATCH:
+                    flush()
+        except Exception as e:
+            self._fail("embedding", e)
+            # Keep draining so the producer never blocks on a full queue
+            while item is not _DONE:
+                item = self.chunk_queue.get()
+        # Always forwarded, so the writer (and run's join) can finish
+        self.write_queue.put(_DONE)
+
+    # ---- stage 3: vector store writes + checkpointing ----
+    def _write(self):
+        last_report = time.monotonic()
+        item = None
+        try:
+            while True:
+                item = self.write_queue.get()
+                if item is _DONE:
+                    return
+                if item[0] == "unit_done":
+                    # Units reach the writer one after another, so every written id
+                    # belongs to the unit that just finished
+                    self.state.done_units.add(item[1])
+                    self.state.written.clear()
+                    self.state.save()
+                    continue
+
+                batch, vectors = item
+                ids = [chunk_id for chunk_id, _, _ in batch]
+                texts = [text for _, text, _ in batch]
+                metadatas = [metadata for _, _, metadata in batch]
+                self._store(ids, texts, vectors, metadatas)
+                self.state.written.update(ids)
+                self.state.save()
+                self.chunks_written += len(batch)
+
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL_SECONDS:
+                    self.report()
+                    last_report = time.monotonic()
+        except Exception as e:
+            self._fail("write", e)
+            while item is not _DONE:
+                item = self.write_queue.get()
+
+    def _store(self, ids, texts, vectors, metadatas):
+        if hasattr(self.vectorstore, "add_embeddings"):
+            # The mmap store is append-only, so skip chunks a crashed run already
+            # appended after its last checkpoint; the id travels in the metadata
+            rows = [
+                (chunk_id, text, vector, {**metadata, "chunk_id": chunk_id})
+                for chunk_id, text, vector, metadata in zip(ids, texts, vectors, metadatas)
+                if chunk_id not in self._stored_ids
+            ]
+            if rows:
+                self.vectorstore.add_embeddings(
+                    [row[1] for row in rows], [row[2] for row in rows], [row[3] for row in rows]
+                )
+                self._stored_ids.update(row[0] for row in rows)
+            new = [(row[1], row[3]) for row in rows]
+        else:
+            # Chroma: upsert by deterministic id so a resumed unit never duplicates chunks
+            self.vectorstore._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+            new = list(zip(texts, metadatas))
+        if self.lexical_index is not None:
+            for text, metadata in new:
+                self.lexical_index.add(text, metadata)
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        print(f"[ingest] {self.pages} pages ({self.pages / elapsed:.1f}/s), "
+              f"{self.chunks_written} chunks ({self.chunks_written / elapsed:.1f}/s), "
+              f"queue {self.chunk_queue.qsize()}/{INGEST_QUEUE_SIZE}")
+
+    def run(self, pdf_paths, urls, headers=None):
+        """Ingest everything not yet done; returns the number of chunks written"""
+        self.started = time.monotonic()
+        if hasattr(self.vectorstore, "add_embeddings"):
+            self._stored_ids = {metadata.get("chunk_id") for _, metadata in self.vectorstore.iter_records()}
+        self.state.complete = False
+        embedder = threading.Thread(target=self._embed, name="ingest-embed", daemon=True)
+        writer = threading.Thread(target=self._write, name="ingest-write", daemon=True)
+        embedder.start()
+        writer.start()
+        try:
+            self._produce(pdf_paths, urls, headers or {})
+        finally:
+            self.chunk_queue.put(_DONE)
+            embedder.join()
+            writer.join()
+
+        # Failed PDF ranges (or a stage failure) leave the run incomplete for a later
+        # resume; web pages that couldn't be fetched are only recorded
+        self.state.complete = not self._errors
+        if self.state.failed_units:
+            print(f"[ingest] {len(self.state.failed_units)} web pages failed and were replaced by fallback docs")
+        self.state.save()
+        self.report()
+        return self.chunks_written
+
+
+def main(argv=None):
+    from symptom_agent.rag_agent import setup_rag_database
+
+    parser = argparse.ArgumentParser(description="Ingest the symptom RAG corpus")
+    parser.add_argument("--fresh", action="store_true", help="ignore saved progress and rebuild")
+    args = parser.parse_args(argv)
+    setup_rag_database(resume=not args.fresh)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,18 @@
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Optional, List
 from langchain_groq import ChatGroq
-from langchain_community.document_loaders import PyPDFLoader, WebBaseLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import Document
 from voice_of_the_doctor import text_to_speech_with_elevenlabs
+from context_builder import assemble_context, CONTEXT_FETCH_K
+from speculation import claim
+from quantized_store import QuantizedMmapVectorStore
+from .bm25_index import BM25Index, BM25_INDEX_PATH, reciprocal_rank_fusion
+from .ingestion import IngestionPipeline, IngestionState
 import os
+import shutil
 
 class RAGState(TypedDict):
     audio_filepath: Optional[str]
@@ -17,6 +21,9 @@ class RAGState(TypedDict):
     speech_to_text: Optional[str]
     doctor_response: Optional[str]
     voice_of_doctor: Optional[str]
+    conversation_context: Optional[str]
+    context_stats: Optional[dict]
+    speculation_id: Optional[str]
 
 # Set USER_AGENT environment variable to avoid warnings
 os.environ["USER_AGENT"] = "MedicalAIAssistant/1.0 (Research Project; contact: admin@example.com)"
@@ -29,84 +36,180 @@ MEDICAL_URLS = [
     "https://medlineplus.gov/symptoms.html"
 ]
 
-def setup_rag_database():
-    """Set up the RAG database with medical information"""
-    documents = []
-    
-    # Load PDF if exists
-    if os.path.exists("med.pdf"):
-        try:
-            pdf_loader = PyPDFLoader("med.pdf")
-            documents.extend(pdf_loader.load())
-            print(f"Loaded {len(documents)} pages from PDF")
-        except Exception as e:
-            print(f"Failed to load PDF: {e}")
-    
-    # Load from medical URLs with proper error handling
-    for url in MEDICAL_URLS:
-        try:
-            # Set headers to avoid blocking
-            headers = {
-                "User-Agent": "MedicalAIAssistant/1.0 (Research Project; contact: admin@example.com)"
-            }
-            web_loader = WebBaseLoader(url, header_template=headers)
-            loaded_docs = web_loader.load()
-            documents.extend(loaded_docs)
-            print(f"Loaded {len(loaded_docs)} documents from {url}")
-        except Exception as e:
-            print(f"Failed to load {url}: {e}")
-            # Add a fallback document with basic medical information
-            fallback_doc = Document(
-                page_content=f"Could not load content from {url}. This is a fallback medical information source.",
-                metadata={"source": "fallback", "url": url}
-            )
-            documents.append(fallback_doc)
-    
-    if not documents:
-        # Add some basic medical information as fallback
-        basic_medical_info = [
-            "Common symptoms include fever, cough, headache, and fatigue.",
-            "Always consult a healthcare professional for medical advice.",
-            "Seek immediate medical attention for severe symptoms like chest pain or difficulty breathing."
-        ]
-        for i, info in enumerate(basic_medical_info):
-            documents.append(Document(page_content=info, metadata={"source": "fallback", "id": i}))
-    
-    # Split documents
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    texts = text_splitter.split_documents(documents)
-    
-    # Create embeddings and vector store
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectorstore = Chroma.from_documents(documents=texts, embedding=embeddings, persist_directory="./chroma_db")
-    vectorstore.persist()
+# "chroma" (default) or "mmap" for the int8 memory-mapped store shared across workers
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+MMAP_INDEX_PATH = os.getenv("MMAP_INDEX_PATH", "./mmap_index")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Open the persisted Chroma index instead of re-ingesting on start (production sets this)
+RAG_REUSE_INDEX = os.getenv("RAG_REUSE_INDEX", "0") == "1"
+# Continue an interrupted ingestion on start; otherwise only `python -m symptom_agent.ingestion` resumes
+RAG_RESUME_INGEST = os.getenv("RAG_RESUME_INGEST", "0") == "1"
+
+def setup_rag_database(resume=False):
+    """Set up the RAG database with medical information.
+
+    Ingestion streams through symptom_agent.ingestion. With resume, an interrupted
+    run continues from its checkpoint instead of starting over.
+    """
+    embeddings = get_embeddings()
+    index_dir = MMAP_INDEX_PATH if VECTOR_BACKEND == "mmap" else "./chroma_db"
+    state_path = os.path.join(index_dir, "ingest_state.json")
+    resume = resume and not _ingestion_finished()
+
+    if VECTOR_BACKEND == "mmap":
+        if not resume:
+            shutil.rmtree(MMAP_INDEX_PATH, ignore_errors=True)
+        vectorstore = QuantizedMmapVectorStore(MMAP_INDEX_PATH, embeddings)
+    else:
+        vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embeddings)
+        if not resume:
+            vectorstore.delete_collection()
+            vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embeddings)
+    os.makedirs(index_dir, exist_ok=True)
+    if not resume and os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"{'Resuming' if resume else 'Starting'} RAG ingestion into {index_dir}")
+
+    # The sparse BM25 index is built from the same stream as the dense one;
+    # a resumed run first indexes the chunks written before the interruption
+    global _bm25_index
+    _bm25_index = BM25Index()
+    if resume:
+        for text, metadata in _stored_records(vectorstore):
+            _bm25_index.add(text, metadata)
+
+    # Set headers to avoid blocking
+    headers = {
+        "User-Agent": "MedicalAIAssistant/1.0 (Research Project; contact: admin@example.com)"
+    }
+    pdf_paths = ["med.pdf"] if os.path.exists("med.pdf") else []
+    IngestionPipeline(vectorstore, embeddings, state_path, lexical_index=_bm25_index).run(
+        pdf_paths, MEDICAL_URLS, headers
+    )
+    if hasattr(vectorstore, "persist"):
+        vectorstore.persist()
+
+    _bm25_index.save(BM25_INDEX_PATH)
+    print(f"Built BM25 index over {len(_bm25_index.texts)} chunks")
     
     return vectorstore
 
+def _stored_records(vectorstore, page_size=1000):
+    """Yield (text, metadata) for every stored chunk, a page at a time"""
+    if isinstance(vectorstore, QuantizedMmapVectorStore):
+        yield from vectorstore.iter_records()
+        return
+    offset = 0
+    while True:
+        page = vectorstore._collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["documents"]:
+            return
+        yield from zip(page["documents"], page["metadatas"])
+        offset += len(page["documents"])
+
 # Cache the vectorstore to avoid rebuilding it every time
 _vectorstore = None
+_bm25_index = None
+_embeddings = None
+
+def get_embeddings():
+    """Get the shared MiniLM embedding model"""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return _embeddings
+
+def _ingestion_finished():
+    index_dir = MMAP_INDEX_PATH if VECTOR_BACKEND == "mmap" else "./chroma_db"
+    state_path = os.path.join(index_dir, "ingest_state.json")
+    return not os.path.exists(state_path) or IngestionState(state_path).complete
 
 def get_vectorstore():
     """Get the vectorstore, creating it if it doesn't exist"""
     global _vectorstore
     if _vectorstore is None:
-        _vectorstore = setup_rag_database()
+        if RAG_RESUME_INGEST and not _ingestion_finished():
+            _vectorstore = setup_rag_database(resume=True)
+        elif VECTOR_BACKEND == "mmap" and os.path.exists(os.path.join(MMAP_INDEX_PATH, "meta.json")):
+            # Already built: just map it, so every worker shares the same pages
+            _vectorstore = QuantizedMmapVectorStore(MMAP_INDEX_PATH, get_embeddings())
+        elif VECTOR_BACKEND == "chroma" and RAG_REUSE_INDEX and os.path.exists("./chroma_db/chroma.sqlite3"):
+            _vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=get_embeddings())
+        else:
+            _vectorstore = setup_rag_database()
+        if not _ingestion_finished():
+            print("[rag] Serving a partially ingested index; run `python -m symptom_agent.ingestion` to resume it")
     return _vectorstore
 
-def query_rag_system(state: RAGState):
-    """Query the RAG system for medical information"""
-    query = state.get("speech_to_text", "") or state.get("query_text", "")
-    
-    if not query:
-        return {"doctor_response": "Please provide a question or description of your symptoms."}
-    
-    # Set up RAG system0
+def get_bm25_index():
+    """Get the BM25 index, loading it from disk or rebuilding it from the Chroma chunks"""
+    global _bm25_index
+    if _bm25_index is None:
+        if os.path.exists(BM25_INDEX_PATH):
+            _bm25_index = BM25Index.load(BM25_INDEX_PATH)
+        else:
+            _bm25_index = BM25Index()
+            for text, metadata in _stored_records(get_vectorstore()):
+                _bm25_index.add(text, metadata)
+            _bm25_index.save(BM25_INDEX_PATH)
+    return _bm25_index
+
+def _dense_search(vectorstore, query_vector, k):
+    """Nearest chunks with the vectors already stored for them, as ([docs], {text: vector})"""
+    if isinstance(vectorstore, QuantizedMmapVectorStore):
+        hits = vectorstore.similarity_search_with_vectors_by_vector(query_vector, k=k)
+    else:
+        result = vectorstore._collection.query(
+            query_embeddings=[query_vector], n_results=k, include=["documents", "metadatas", "embeddings"]
+        )
+        hits = [
+            (Document(page_content=text, metadata=metadata or {}), vector)
+            for text, metadata, vector in zip(result["documents"][0], result["metadatas"][0], result["embeddings"][0])
+        ]
+    return [doc for doc, _ in hits], {doc.page_content: vector for doc, vector in hits}
+
+def _fuse(query, index, vectorstore, query_vector, k):
+    dense_docs, stored_vectors = _dense_search(vectorstore, query_vector, k)
+    docs = reciprocal_rank_fusion([dense_docs, index.search_documents(query, k)], k)
+    # Chunks only BM25 found have no vector at hand; the context builder embeds those
+    return docs, query_vector, [stored_vectors.get(doc.page_content) for doc in docs]
+
+def retrieve(query, k=CONTEXT_FETCH_K):
+    """Hybrid retrieval returning (documents, query_vector, doc_vectors).
+
+    Short keyword queries are answered from BM25 alone and both vectors are None;
+    everything else fuses BM25 and dense results with reciprocal rank fusion, and
+    doc_vectors holds the stored vector of each dense hit so it isn't re-embedded.
+    """
+    index = get_bm25_index()
+    if index.is_keyword_query(query):
+        return index.search_documents(query, k), None, None
+
     vectorstore = get_vectorstore()
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-    relevant_docs = retriever.get_relevant_documents(query)
-    
-    # Prepare context
-    context = "\n\n".join([doc.page_content for doc in relevant_docs])
+    return _fuse(query, index, vectorstore, vectorstore.embeddings.embed_query(query), k)
+
+def retrieve_documents_batch(queries, k=CONTEXT_FETCH_K):
+    """Hybrid retrieval for many queries with a single batched embedding call"""
+    if not queries:
+        return []
+    vectorstore = get_vectorstore()
+    index = get_bm25_index()
+    query_vectors = vectorstore.embeddings.embed_documents(list(queries))
+    return [_fuse(query, index, vectorstore, vector, k) for query, vector in zip(queries, query_vectors)]
+
+def answer_with_context(query, relevant_docs, conversation_context="", query_vector=None, lexical_only=False,
+                        doc_vectors=None):
+    """Answer the question with the LLM using already retrieved documents.
+
+    Returns (answer, context_stats) where context_stats reports the tokens the
+    context builder saved for this request.
+    """
+    # Prepare a compact, token-budgeted context from the over-retrieved chunks;
+    # the lexical fast path keeps BM25 order instead of embedding the chunks
+    embeddings = None if lexical_only else get_vectorstore().embeddings
+    context, context_stats = assemble_context(query, relevant_docs, embeddings, query_vector=query_vector, doc_vectors=doc_vectors)
+    if conversation_context:
+        query = f"{conversation_context}\n\nCurrent question: {query}"
     
     # Query the LLM with context
     llm = ChatGroq(
@@ -128,8 +231,25 @@ def query_rag_system(state: RAGState):
     
     chain = prompt | llm
     response = chain.invoke({"context": context, "question": query})
+    return response.content, context_stats
+
+def query_rag_system(state: RAGState):
+    """Query the RAG system for medical information"""
+    query = state.get("speech_to_text", "") or state.get("query_text", "")
     
-    return {"doctor_response": response.content}
+    if not query:
+        return {"doctor_response": "Please provide a question or description of your symptoms."}
+    
+    # Over-retrieve with hybrid search and let the context builder pick what fits;
+    # the route node may already have started this retrieval speculatively
+    prefetched, result = claim("symptom_agent", query, state.get("speculation_id"))
+    relevant_docs, query_vector, doc_vectors = result if prefetched else retrieve(query)
+    
+    doctor_response, context_stats = answer_with_context(
+        query, relevant_docs, state.get("conversation_context", ""),
+        query_vector=query_vector, lexical_only=query_vector is None, doc_vectors=doc_vectors
+    )
+    return {"doctor_response": doctor_response, "context_stats": context_stats}
 
 def generate_voice_response(state: RAGState):
     """Convert the doctor's response to speech"""
@@ -2,6 +2,7 @@ from langgraph.graph import StateGraph, END
 from typing import TypedDict, Optional
 from .image_voice_agent import create_image_voice_agent
 from .rag_agent import create_rag_agent
+from .fusion_agent import create_fusion_agent, FUSION_ENABLED
 
 class SymptomState(TypedDict):
     audio_filepath: Optional[str]
@@ -10,11 +11,18 @@ class SymptomState(TypedDict):
     speech_to_text: Optional[str]
     doctor_response: Optional[str]
     voice_of_doctor: Optional[str]
+    conversation_context: Optional[str]
+    branch_timings: Optional[dict]  # Per-branch seconds from the fused image + text path
+    context_stats: Optional[dict]  # Tokens saved by the RAG context builder
+    speculation_id: Optional[str]  # Key of the retrieval prefetched while routing
     next_node: Optional[str]  # Add this field
 
 def route_symptom_analysis(state: SymptomState):
     """Determine which symptom analysis approach to use"""
     if state.get("image_filepath"):
+        # A photo with a description also gets the RAG knowledge, fused with the vision answer
+        if FUSION_ENABLED and (state.get("speech_to_text") or state.get("query_text")):
+            return {"next_node": "fusion_agent"}
         return {"next_node": "image_voice_agent"}
     else:
         return {"next_node": "rag_agent"}
@@ -27,6 +35,7 @@ def create_symptom_agent():
     workflow.add_node("route", route_symptom_analysis)
     workflow.add_node("image_voice_agent", create_image_voice_agent())
     workflow.add_node("rag_agent", create_rag_agent())
+    workflow.add_node("fusion_agent", create_fusion_agent())
     
     # Set entry point
     workflow.set_entry_point("route")
@@ -38,10 +47,12 @@ def create_symptom_agent():
         lambda state: state.get("next_node", "rag_agent"),
         {
             "image_voice_agent": "image_voice_agent",
-            "rag_agent": "rag_agent"
+            "rag_agent": "rag_agent",
+            "fusion_agent": "fusion_agent"
         }
     )
     workflow.add_edge("image_voice_agent", END)
     workflow.add_edge("rag_agent", END)
+    workflow.add_edge("fusion_agent", END)
     
     return workflow.compile()
\ No newline at end of file
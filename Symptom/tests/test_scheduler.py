@@ -0,0 +1,43 @@
+import pytest
+from scheduler import URGENT, NORMAL, LOW, detect_urgency
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Red flags
+    ("I have crushing chest pain", URGENT),
+    ("chest tightness since this morning", URGENT),
+    ("I can't breathe", URGENT),
+    ("I can’t breathe properly", URGENT),  # smart quote from a mobile keyboard
+    ("I cant breathe", URGENT),
+    ("having difficulty breathing", URGENT),
+    ("shortness of breath when walking", URGENT),
+    ("her face is drooping and she has slurred speech", URGENT),
+    ("I think he is having a stroke", URGENT),
+    ("my father collapsed", URGENT),
+    ("my son had a seizure", URGENT),
+    ("the cut won't stop bleeding", URGENT),
+    ("the cut won’t stop bleeding", URGENT),
+    ("the bleeding won't stop", URGENT),
+    ("I am coughing up blood", URGENT),
+    ("I am coughing blood", URGENT),
+    ("I've been vomiting blood", URGENT),
+    ("my throat is swelling after a bee sting", URGENT),
+    ("I want to kill myself", URGENT),
+    ("worst headache of my life", URGENT),
+    ("my child swallowed poison", URGENT),
+    ("CHEST PAIN", URGENT),
+    # Red flags win over prevention wording
+    ("how do I prevent chest pain from turning into a heart attack", URGENT),
+    # Information requests
+    ("how can I prevent the flu?", LOW),
+    ("tips to reduce the risk of diabetes", LOW),
+    ("how to avoid getting malaria", LOW),
+    # Everything else
+    ("I have a rash on my arm", NORMAL),
+    ("my knee hurts after running", NORMAL),
+    ("I have a cough", NORMAL),
+    ("", NORMAL),
+    (None, NORMAL),
+])
+def test_detect_urgency(text, expected):
+    assert detect_urgency(text) == expected
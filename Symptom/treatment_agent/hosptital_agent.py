@@ -3,6 +3,8 @@ import json
 import os
 from typing import TypedDict, Optional
 from dotenv import load_dotenv
+from request_coalescing import fingerprint
+from shared_cache import cached
 
 # Load environment variables from .env file
 load_dotenv()
@@ -49,10 +51,17 @@ def hospitals_agent(state: AgentState):
     }
 
     try:
-        conn.request("POST", "/maps", payload, headers)
-        res = conn.getresponse()
-        data = res.read()
-        result = json.loads(data.decode("utf-8"))
+        def search_maps():
+            conn.request("POST", "/maps", payload, headers)
+            res = conn.getresponse()
+            data = json.loads(res.read().decode("utf-8"))
+            # Raising keeps quota and error payloads out of the 24h cache
+            if res.status != 200 or "places" not in data:
+                raise RuntimeError(f"Serper maps returned {res.status}: {data}")
+            return data
+
+        # Nearby places barely change; share lookups for the same query and area
+        result = cached("geo", fingerprint("maps", query, round(float(latitude), 3), round(float(longitude), 3)), search_maps)
         
         print("API RESPONSE =======", result)
 
@@ -2,10 +2,16 @@ import os
 from gtts import gTTS
 import elevenlabs
 from elevenlabs.client import ElevenLabs
+import time
+import shutil
 import subprocess
 import platform
+from request_coalescing import fingerprint, tts_flight
+from shared_cache import cache_get, cache_set, NAMESPACE_TTLS
 
 ELEVENLABS_API_KEY = os.environ.get("ELEVEN_API_KEY")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "500"))
 
 def text_to_speech_with_gtts(input_text, output_filepath):
     language = "en"
@@ -29,7 +35,7 @@ def text_to_speech_with_gtts(input_text, output_filepath):
     except Exception as e:
         print(f"An error occurred while trying to play the audio: {e}")
 
-def text_to_speech_with_elevenlabs(input_text, output_filepath):
+def _render_elevenlabs(input_text, output_filepath):
     client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
     audio = client.generate(
         text=input_text,
@@ -38,6 +44,58 @@ def text_to_speech_with_elevenlabs(input_text, output_filepath):
         model="eleven_turbo_v2"
     )
     elevenlabs.save(audio, output_filepath)
+
+def _render_cached(input_text):
+    """Render each distinct text once across all workers and return the cached mp3 path"""
+    key = fingerprint("elevenlabs", "Aria", "eleven_turbo_v2", input_text)
+    cached_path = cache_get("tts", key)
+    if cached_path and os.path.exists(cached_path):
+        os.utime(cached_path)  # mtime doubles as last use for pruning
+        return cached_path
+
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    cached_path = os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+    tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+    _render_elevenlabs(input_text, tmp_path)
+    os.replace(tmp_path, cached_path)
+    cache_set("tts", key, cached_path)
+    _prune_tts_cache()
+    return cached_path
+
+def _prune_tts_cache():
+    """Delete cached mp3s older than the tts TTL, then the least recently used past TTS_CACHE_MAX_MB"""
+    cutoff = time.time() - NAMESPACE_TTLS["tts"]
+    files = []
+    for entry in os.scandir(TTS_CACHE_DIR):
+        if not entry.name.endswith(".mp3"):
+            continue
+        try:
+            stat = entry.stat()
+            if stat.st_mtime < cutoff:
+                os.remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            continue  # removed by another worker
+    excess = sum(size for _, size, _ in files) - TTS_CACHE_MAX_MB * 1024 * 1024
+    for _, size, path in sorted(files):
+        if excess <= 0:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        excess -= size
+
+def speech_file(input_text):
+    """Path of the cached mp3 for input_text in TTS_CACHE_DIR, rendered once across workers"""
+    return tts_flight.do(fingerprint("elevenlabs", input_text), _render_cached, input_text)
+
+def text_to_speech_with_elevenlabs(input_text, output_filepath, play=True):
+    cached_path = speech_file(input_text)
+    shutil.copyfile(cached_path, output_filepath)
+    if not play:
+        return output_filepath
     os_name = platform.system()
     try:
         if os_name == "Darwin":  # macOS
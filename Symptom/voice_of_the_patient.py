@@ -36,11 +36,11 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
 def transcribe_with_groq(GROQ_API_KEY, audio_filepath, stt_model="whisper-large-v3"):
     client = Groq(api_key=GROQ_API_KEY)
     
-    audio_file = open(audio_filepath, "rb")
-    transcription = client.audio.transcriptions.create(
-        model=stt_model,
-        file=audio_file,
-        language="en"
-    )
+    with open(audio_filepath, "rb") as audio_file:
+        transcription = client.audio.transcriptions.create(
+            model=stt_model,
+            file=audio_file,
+            language="en"
+        )
 
     return transcription.text
\ No newline at end of file
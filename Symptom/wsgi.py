@@ -0,0 +1,9 @@
+"""WSGI entry point: gunicorn -c gunicorn.conf.py wsgi:app"""
+from dotenv import load_dotenv
+load_dotenv()
+
+from production import preload
+
+preload()
+
+from ex import app  # noqa: E402